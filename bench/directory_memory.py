@@ -0,0 +1,68 @@
+"""
+Measure memory held by a synthetic 100k-user directory, storing users as full
+API dicts versus compact records.
+
+usage: python bench/directory_memory.py [num_users]
+"""
+import sys
+import gc
+import tracemalloc
+
+from slacksocket.models import User, CompactUser
+from slacksocket.webclient import Directory
+
+def fake_user(i):
+    return { 'id': 'U%08d' % i,
+             'team_id': 'T00000001',
+             'name': 'user%d' % i,
+             'deleted': False,
+             'color': '9f69e7',
+             'real_name': 'Synthetic User %d' % i,
+             'tz': 'America/New_York',
+             'tz_label': 'Eastern Daylight Time',
+             'tz_offset': -14400,
+             'profile': { 'title': '',
+                          'phone': '',
+                          'skype': '',
+                          'real_name': 'Synthetic User %d' % i,
+                          'real_name_normalized': 'Synthetic User %d' % i,
+                          'display_name': 'user%d' % i,
+                          'display_name_normalized': 'user%d' % i,
+                          'status_text': '',
+                          'status_emoji': '',
+                          'avatar_hash': 'ge3b51ca72de',
+                          'image_24': 'https://example.com/%d_24.png' % i,
+                          'image_32': 'https://example.com/%d_32.png' % i,
+                          'image_48': 'https://example.com/%d_48.png' % i,
+                          'image_72': 'https://example.com/%d_72.png' % i,
+                          'image_192': 'https://example.com/%d_192.png' % i,
+                          'image_512': 'https://example.com/%d_512.png' % i,
+                          'team': 'T00000001' },
+             'is_admin': False,
+             'is_owner': False,
+             'is_bot': False,
+             'updated': 1502138686 }
+
+def measure(make, n):
+    gc.collect()
+    tracemalloc.start()
+    d = Directory()
+    # build each record straight from a fresh API dict, as a page load would
+    d.update(make(fake_user(i)) for i in range(n))
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return used
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    results = [
+        ('full', measure(User, n)),
+        ('compact', measure(lambda d: CompactUser(d, ('real_name', 'tz')), n)),
+        ('compact (id/name only)', measure(lambda d: CompactUser(d), n)),
+    ]
+    for label, used in results:
+        print('%-24s %8.1f MB  %6d bytes/user' % (label, used / 2**20, used // n))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Measure event decoding and re-encoding throughput with each available JSON
+codec, for a mix of typical RTM frames.
+
+usage: python bench/parse.py [iterations]
+"""
+import sys
+import json
+import time
+
+from slacksocket import codec
+from slacksocket.models import SlackEvent
+
+FRAMES = [
+    json.dumps({ 'type': 'message',
+                 'channel': 'C2147483705',
+                 'user': 'U2147483697',
+                 'text': 'Hello <@U2147483698>, the deploy of <https://example.com/build/1234|build 1234> finished',
+                 'ts': '1355517523.000005',
+                 'team': 'T00000001',
+                 'blocks': [ { 'type': 'rich_text',
+                               'block_id': 'a1b2c',
+                               'elements': [ { 'type': 'rich_text_section',
+                                               'elements': [ { 'type': 'text', 'text': 'Hello ' },
+                                                             { 'type': 'user', 'user_id': 'U2147483698' } ] } ] } ],
+                 'client_msg_id': '2bc86e2c-1d06-4f65-b0d1-24f1c4b5f3e0' }),
+    json.dumps({ 'type': 'presence_change', 'user': 'U2147483697', 'presence': 'away' }),
+    json.dumps({ 'type': 'user_typing', 'channel': 'C2147483705', 'user': 'U2147483697' }),
+    json.dumps({ 'type': 'reaction_added',
+                 'user': 'U2147483697',
+                 'reaction': 'thumbsup',
+                 'item_user': 'U2147483698',
+                 'item': { 'type': 'message', 'channel': 'C2147483705', 'ts': '1360782400.498405' },
+                 'event_ts': '1360782804.083113' }),
+]
+
+def rate(func, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        for frame in FRAMES:
+            func(frame)
+    return n * len(FRAMES) / (time.perf_counter() - start)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    default = codec.name
+
+    print('%-8s %12s %18s %18s' % ('codec', 'decode/s', 're-encoded .json/s', 'raw frame .json/s'))
+    for name in codec.available():
+        codec.use(name)
+        decode = rate(SlackEvent.decode, n)
+        # .json encoding the event, as before raw frames were kept
+        reencode = rate(lambda f: SlackEvent(codec.loads(f)).json, n)
+        reuse = rate(lambda f: SlackEvent.decode(f).json, n)
+        print('%-8s %12.0f %18.0f %18.0f' % (name, decode, reencode, reuse))
+
+    codec.use(default)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+End-to-end benchmarks against a local FakeSlack server: startup time, event
+throughput, delivery latency percentiles and directory memory use. The
+server runs in-process, so results include its overhead.
+
+usage: python bench/suite.py [startup|throughput|latency|memory ...]
+"""
+import gc
+import sys
+import time
+import threading
+import tracemalloc
+
+from slacksocket import SlackSocket
+from slacksocket.fakeslack import FakeSlack
+from slacksocket.metrics import Latency
+from slacksocket.retry import RequestPolicy
+from slacksocket.webclient import WebClient
+
+def connect(fake, **opts):
+    # the fake server is not rate limited, so neither are requests to it
+    return SlackSocket('xoxb-bench', api_url=fake.api_url, handle_signals=False,
+                       policy=RequestPolicy(rate_limit=False), **opts)
+
+def startup(users=10000):
+    """ time to connect, and to load the directory """
+    with FakeSlack(users=users, channels=users // 10) as fake:
+        start = time.perf_counter()
+        s = connect(fake)
+        connected = time.perf_counter() - start
+        s.wait_for_directory()
+        loaded = time.perf_counter() - start
+        s.close()
+
+    print('startup (%d users)    connected %6.3fs   directory loaded %6.3fs' %
+          (users, connected, loaded))
+
+def throughput(n=50000, batch=500):
+    """ events per second received, processed and consumed """
+    event = { 'type': 'message', 'channel': 'C00000001', 'user': 'U00000001',
+              'text': 'hello <@U00000002>', 'ts': '1355517523.000005' }
+
+    with FakeSlack() as fake:
+        s = connect(fake, max_queue=n)
+        s.wait_for_directory()
+        fake.wait_clients()
+        s.get_event('hello', timeout=5)
+
+        start = time.perf_counter()
+        sender = threading.Thread(target=fake.replay, args=([event] * n,))
+        sender.start()
+
+        received = 0
+        while received < n:
+            received += len(s.get_events('message', max_n=batch, timeout=10) or [])
+        elapsed = time.perf_counter() - start
+        sender.join()
+        s.close()
+
+    print('throughput           %8.0f events/s (%d events)' % (n / elapsed, n))
+
+def latency(n=10000, rate=2000):
+    """ time from an event being sent to its delivery to the consumer """
+    def event():
+        return { 'type': 'message', 'channel': 'C00000001', 'user': 'U00000001',
+                 'text': 'hello', 'sent': time.perf_counter() }
+
+    lat = Latency(window=n)
+    with FakeSlack() as fake:
+        s = connect(fake)
+        s.wait_for_directory()
+        fake.wait_clients()
+
+        sender = threading.Thread(target=fake.replay, args=([event] * n, rate))
+        sender.start()
+        for _ in range(n):
+            e = s.get_event('message', timeout=10)
+            lat.since(e['sent'])
+        sender.join()
+        s.close()
+
+    summary = lat.summary()
+    print('latency (%d/s)      p50 %6.2fms   p90 %6.2fms   p99 %6.2fms   max %6.2fms' %
+          (rate, summary['p50'] * 1e3, summary['p90'] * 1e3,
+           summary['p99'] * 1e3, summary['max'] * 1e3))
+
+def memory(users=10000):
+    """ memory held per 10k directory entries, as loaded from the api """
+    with FakeSlack(users=users, channels=0, ims=0) as fake:
+        for label, opts in [ ('full', {}), ('compact', { 'user_fields': () }) ]:
+            gc.collect()
+            tracemalloc.start()
+            client = WebClient('xoxb-bench', 0, api_url=fake.api_url,
+                               policy=RequestPolicy(rate_limit=False), **opts)
+            client.preload()
+            client.close()
+            gc.collect()
+            used, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del client
+            print('memory (%-7s)      %8.2f MB per 10k users' % (label, used * 10000 / users / 2**20))
+
+BENCHMARKS = { 'startup': startup,
+               'throughput': throughput,
+               'latency': latency,
+               'memory': memory }
+
+def main():
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,8 @@ setup(name='slacksocket',
       author_email='bradley@vektor.nyc',
       url='https://github.com/vektorlab/slacksocket',
       install_requires=['requests>=2.9.1', 'websocket-client==0.56.0'],
+      extras_require={'asyncio': ['aiohttp>=3.6'],
+                      'fast': ['orjson']},
       license='http://opensource.org/licenses/MIT',
       classifiers=(
           'Intended Audience :: Developers',
@@ -0,0 +1,700 @@
+import time
+import asyncio
+import logging
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import slacksocket.errors as errors
+from . import codec
+from .config import make_urls, directory_event_types, page_limits, rtm_url_ttl
+from .metrics import Latency
+from .models import SlackEvent, SlackMsg, User, Channel, DirItem, item_id, peek_type
+from .retry import RequestPolicy, api_method, retry_after
+from .sender import TokenBucket
+from .subscription import Dispatcher, remaining
+from .webclient import DirectoryCache
+
+log = logging.getLogger('slacksocket')
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise ImportError('asyncio support requires aiohttp, '
+                          'install with: pip install slacksocket[asyncio]')
+
+class AsyncWebClient(DirectoryCache):
+    """
+    asyncio counterpart to WebClient
+    params:
+     - token(str): token to authenticate with slack
+     - timeout(int): maximum amount of time to retry a failing API call
+     - session(aiohttp.ClientSession): Optional session to make requests with,
+       which may be shared between clients. If not given, one is created and
+       closed along with the client.
+     - request_timeout(float): maximum time to wait for a response to a
+       single API request. default 5
+     - api_url(str): base url of the Slack web API. default https://slack.com/api/
+     - policy(RequestPolicy): retry and rate limit policy for API requests,
+       which may be shared between clients. default RequestPolicy()
+     - **opts: directory options, see DirectoryCache. lazy_fields is not supported.
+    """
+
+    def __init__(self, token, timeout=0, session=None, request_timeout=5,
+                 policy=None, api_url=None, **opts):
+        _require_aiohttp()
+        opts['lazy_fields'] = False
+        DirectoryCache.__init__(self, **opts)
+
+        self._token = token
+        self._urls = make_urls(api_url)
+        self._timeout = timeout
+        self.request_timeout = request_timeout
+        self.policy = policy or RequestPolicy()
+        self._session = session
+        self._own_session = session is None
+        self._lock = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self):
+        """ close the client session, if owned by this client """
+        if self._own_session and self._session:
+            await self._session.close()
+            self._session = None
+
+    async def login(self):
+        """ perform API auth test returning user and team """
+        log.debug('performing auth test')
+        test = await self._get(self._urls['test'])
+        user = User({ 'name': test['user'], 'id': test['user_id'] })
+        self.team_id = test.get('team_id')
+        return test['team'], user
+
+    async def preload(self):
+        """ load the user/channel directory cache, if not already loaded """
+        await self._refresh_once()
+
+    async def rtm_url(self):
+        """ Retrieve a fresh websocket url from slack api """
+        return (await self._get(self._urls['rtm']))['url']
+
+    async def user(self, match):
+        """ Return User object for a given Slack ID or name """
+        return await self._lookup(User, self._user_key(match), match)
+
+    async def channel(self, match):
+        """ Return Channel object for a given Slack ID or name """
+        return await self._lookup(Channel, self._channel_key(match), match)
+
+    #######
+    # Internal Methods
+    #######
+
+    async def _get(self, url, **params):
+        return await self._do('GET', url, **params)
+
+    async def _post(self, url, **params):
+        return await self._do('POST', url, **params)
+
+    async def _do(self, method, url, **params):
+        deadline = time.monotonic() + self._timeout if self._timeout > 0 else None
+        api = api_method(url)
+        params['token'] = self._token
+        attempt = 0
+
+        while True:
+            await asyncio.sleep(self.policy.wait_time(api, time.monotonic(), self._token))
+            attempt += 1
+            try:
+                return await self._do_once(method, url, **params)
+            except Exception as ex:
+                delay = self.policy.retry_time(api, attempt, ex, time.monotonic(),
+                                              self._token)
+                if delay is None:
+                    raise
+                log.error('%s failed, retrying in %.1fs: %s' % (api, delay, ex))
+
+            if deadline and time.monotonic() + delay >= deadline:
+                raise errors.TimeoutError('connection timeout exceeded')
+            await asyncio.sleep(delay)
+
+    async def _do_once(self, method, url, **params):
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        async with self.session.request(method, url, params=params, timeout=timeout) as res:
+            if res.status == 429:
+                raise errors.RateLimitError('rate limited by slack api',
+                                            retry_after(res.headers.get('Retry-After')))
+            if res.status >= 500:
+                # server errors are retried
+                raise IOError('%d error from slack api: %s' % (res.status, res.reason))
+            if res.status >= 400:
+                raise errors.APIError('%d error from slack api: %s' % (res.status, res.reason))
+            text = await res.text()
+
+        rj = codec.loads(text)
+
+        if rj['ok']:
+            return rj
+
+        # process error
+        if rj['error'] == 'migration_in_progress':
+            raise RuntimeError('socket in migration state')
+
+        raise errors.APIError('Error from slack api:\n%s' % text)
+
+    async def _get_pages(self, url, **params):
+        params['cursor'] = ''
+        params.setdefault('limit', 200)
+
+        while True:
+            res = await self._get(url, **params)
+            if 'response_metadata' in res:
+                params['cursor'] = res['response_metadata'].get('next_cursor')
+            yield res
+            if not params['cursor']:
+                return
+
+    async def _lookup(self, stype, attr, val):
+        sdir = self._dir(stype)
+        res = sdir.match(attr, val)
+        if res:
+            return res
+
+        key = (stype, attr, val)
+        if self._missed(key):
+            return DirItem({})
+
+        # reload cache and try again
+        await self._refresh_once()
+        res = sdir.match(attr, val)
+        if not res:
+            self._miss(key)
+            return DirItem({})
+        return res
+
+    async def _refresh_once(self):
+        """
+        refresh internal directory cache on behalf of a lookup miss. concurrent
+        callers share a single in-progress refresh, and no refresh is made if
+        the last one completed less than refresh_interval seconds ago
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        generation = self._generation
+        async with self._lock:
+            if generation != self._generation:
+                return # refreshed by another caller while we waited
+            if time.time() - self._refreshed < self.refresh_interval:
+                return
+            await self._load()
+        # snapshots are written off the event loop
+        await asyncio.get_event_loop().run_in_executor(None, self._save_snapshot)
+
+    async def _load(self):
+        """ page through users and channels concurrently """
+        if self._reader:
+            return
+        log.debug('refreshing directory cache')
+        ims = []
+        changes = self._changes = { User: [], Channel: [] }
+        try:
+            users, channels = await asyncio.gather(self._users_list(),
+                                                   self._channels_list(ims))
+            self._users.update(users, changes[User])
+            channels.extend(self._im_items(ims))
+            self._channels.update(channels, changes[Channel])
+        finally:
+            self._changes = None
+
+        self._loaded()
+
+    async def _users_list(self):
+        return [ self._make_user(data)
+                 async for page in self._get_pages(self._urls['users'], limit=page_limits['users'])
+                 for data in page['members'] ]
+
+    async def _channels_list(self, ims):
+        pages = self._get_pages(self._urls['convos'], limit=page_limits['convos'],
+                types='public_channel,private_channel,mpim,im')
+        return [ channel async for page in pages
+                 for channel in self._channel_items(page, ims) ]
+
+class AsyncSubscription(object):
+    """
+    asyncio counterpart to Subscription
+    params:
+     - etypes(list): event types to receive. If empty, all events are received.
+    """
+
+    def __init__(self, etypes=()):
+        self.etypes = frozenset(etypes)
+        self._q = asyncio.Queue()
+
+    def put(self, event):
+        self._q.put_nowait(event)
+
+    async def get_event(self, timeout=None):
+        """
+        Return a single event object or wait until an event is received and
+        return it, raising asyncio.TimeoutError if timeout is exceeded
+         - timeout(int): Max time, in seconds, to wait for new event
+        """
+        e = await asyncio.wait_for(self._q.get(), timeout)
+        if isinstance(e, Exception):
+            raise e
+        return e
+
+    async def events(self, idle_timeout=None):
+        """
+        returns an async generator yielding Slack event objects
+        params:
+         - idle_timeout(int): optional maximum amount of time (in seconds)
+           to wait between events before returning
+        """
+        while True:
+            try:
+                yield await self.get_event(timeout=idle_timeout)
+            except asyncio.TimeoutError:
+                log.info('idle timeout reached for events()')
+                return
+
+    def qsize(self):
+        return self._q.qsize()
+
+class AsyncSlackSocket(Dispatcher):
+    """
+    asyncio counterpart to SlackSocket, running on the current event loop.
+    Any number of sockets may share a loop.
+
+        async with AsyncSlackSocket('<slack-token>') as s:
+            async for event in s.events('message'):
+                await s.send_msg('hello', event.channel)
+
+    params:
+     - slacktoken(str): token to authenticate with slack
+     - connect_timeout(int): Optional maximum amount of time to wait for connection to succeed.
+     - track_changes(bool): Optional. Apply directory change events as they are received. default False
+     - catch_all(bool): Optional. Queue all received events for get_event() and events(). default True
+     - send_rate(float): Optional. Messages per second allowed per channel. default 1
+     - send_burst(int): Optional. Messages allowed per channel in a burst. default 3
+     - session(aiohttp.ClientSession): Optional session for API requests and
+       the websocket, which may be shared between sockets
+     - ws_session(aiohttp.ClientSession): Optional session for the websocket
+       connection only, if different from session
+     - standby_url(bool): Optional. Keep a websocket url fetched in advance for
+       reconnection, as with SlackSocket. default False
+     - **opts: API request and directory options, see AsyncWebClient
+    """
+    subscription = AsyncSubscription
+
+    def __init__(self, slacktoken, connect_timeout=0, track_changes=False,
+                 catch_all=True, send_rate=1.0, send_burst=3, session=None,
+                 ws_session=None, standby_url=False, **opts):
+        Dispatcher.__init__(self)
+        if track_changes:
+            # directory changes are applied whether or not they are subscribed to
+            self._tracked = frozenset(directory_event_types)
+
+        self.ws = None
+        self.team = None
+        self.user = None
+        self.timeout = connect_timeout
+        self.track_changes = track_changes
+        self.catch_all = catch_all
+        self.send_rate = send_rate
+        self.send_burst = send_burst
+
+        self._slack = AsyncWebClient(slacktoken, connect_timeout, session=session, **opts)
+        self._ws_session = ws_session
+        self.standby_url = standby_url
+        self._standby = None # (websocket url, time fetched)
+
+        # stats tracking
+        self._stats = {
+          'events_received': 0,
+          'events_dropped': 0,
+          'messages_sent': 0,
+          'connected_since': 0
+        }
+        self._enrich_time = Latency()
+        self._ack_time = Latency()
+        self._reconnect_time = Latency()
+
+        self._send_id = 0
+        self._unacked = {}
+        self._buckets = {}
+
+        self._tasks = []
+        self._closing = False
+        self._connected = None # set while the websocket is open
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.close()
+
+    async def connect(self):
+        """ Authenticate and open the websocket connection, returning this socket """
+        # loop-bound primitives are created on the loop running the socket
+        self._warm = asyncio.Event()
+        self._connected = asyncio.Event()
+        self._pending = asyncio.Queue()
+        self._eventq = AsyncSubscription()
+        if self.catch_all:
+            self._add_sub(self._eventq)
+
+        try:
+            self.team, self.user = await self._slack.login()
+
+            # load directory concurrently with websocket connection
+            self._spawn(self._warmup())
+            self._spawn(self._enrich())
+
+            await asyncio.wait_for(self._open(), self.timeout or None)
+        except (Exception, asyncio.CancelledError):
+            # stop directory loading and release the session
+            await self.close()
+            raise
+
+        self._spawn(self._run())
+        if self.standby_url:
+            self._spawn(self._keep_standby())
+        return self
+
+    @property
+    def team_id(self):
+        return self._slack.team_id
+
+    async def wait_for_directory(self, timeout=None):
+        """
+        Wait until the user/channel directory is loaded, from a snapshot or
+        the API, raising asyncio.TimeoutError if timeout is exceeded
+        """
+        await asyncio.wait_for(self._warm.wait(), timeout)
+
+    def stats(self):
+        """
+        Return a dictionary of AsyncSlackSocket stats, as with SlackSocket.stats()
+        """
+        return dict(self._stats,
+                    events_recieved=self._stats['events_received'], # deprecated misspelling
+                    enrich_queue_depth=self._pending.qsize(),
+                    enrich_time=self._enrich_time.summary(),
+                    reconnect_time=self._reconnect_time.summary(),
+                    messages_unacked=len(self._unacked),
+                    ack_time=self._ack_time.summary(),
+                    api=self._slack.policy.stats(),
+                    directory=self._slack.stats())
+
+    async def get_event(self, *etypes, timeout=None):
+        """
+        Return a single event object or wait until an event is received and
+        return it, raising asyncio.TimeoutError if timeout is exceeded
+         - etypes(str): If defined, Slack event type(s) not matching
+           the filter will be ignored.
+         - timeout(int): Max time, in seconds, to wait for new event
+        """
+        if not self.catch_all:
+            raise errors.ConfigError('get_event() requires catch_all, see subscribe()')
+
+        self._validate_etypes(*etypes)
+        deadline = time.time() + timeout if timeout is not None else None
+
+        while True:
+            e = await self._eventq.get_event(timeout=remaining(deadline))
+
+            self._stats['events_received'] += 1
+            if not etypes or e.type in etypes:
+                return e
+
+            log.debug('ignoring filtered %s event', e.type)
+            self._stats['events_dropped'] += 1
+
+    async def events(self, *etypes, idle_timeout=None):
+        """
+        returns an async generator yielding Slack event objects
+        params:
+         - etypes(str): If defined, Slack event type(s) not matching
+           the filter will be ignored.
+         - idle_timeout(int): optional maximum amount of time (in seconds)
+           to wait between events before returning
+        """
+        while not self._closing:
+            try:
+                yield await self.get_event(*etypes, timeout=idle_timeout)
+            except asyncio.TimeoutError:
+                log.info('idle timeout reached for events()')
+                return
+
+    async def send_msg(self, text, channel, confirm=True, timeout=None):
+        """
+        Send a message to a channel or group via Slack RTM socket, returning
+        the resulting message object
+
+        params:
+         - text(str): Message text to send
+         - channel(Channel): Target channel
+         - confirm(bool): If True, wait for a reply-to confirmation before returning.
+         - timeout(int): Max time, in seconds, to wait for confirmation
+
+        As with SlackSocket, messages sent while disconnected are held until
+        the connection is reestablished
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        bucket = self._buckets.get(channel.id)
+        if bucket is None:
+            bucket = self._buckets[channel.id] = TokenBucket(self.send_rate, self.send_burst)
+
+        delay = bucket.delay(time.monotonic())
+        while delay:
+            await asyncio.sleep(delay)
+            delay = bucket.delay(time.monotonic())
+        bucket.take()
+
+        msg = SlackMsg(None, channel.id, text)
+        try:
+            await asyncio.wait_for(self._connected.wait(), remaining(deadline))
+            if self._closing:
+                raise errors.ExitError('stopped')
+
+            self._send_id += 1
+            msg.id = self._send_id
+            if confirm:
+                future = asyncio.get_event_loop().create_future()
+                self._unacked[msg.id] = (msg, future, time.perf_counter())
+            try:
+                await self.ws.send_str(msg.json)
+            except Exception as ex:
+                if not confirm:
+                    raise
+                # sent again by _resend once reconnected
+                log.warn('unable to send message, resending on reconnection: %s' % ex)
+            else:
+                self._stats['messages_sent'] += 1
+            if not confirm:
+                return msg
+            return await asyncio.wait_for(future, remaining(deadline))
+        except asyncio.TimeoutError:
+            raise errors.TimeoutError('no reply to message %s' % msg.id)
+        finally:
+            self._unacked.pop(msg.id, None)
+
+    async def lookup_user(self, match):
+        """ Return User object for a given Slack ID or name """
+        return await self._slack.user(match)
+
+    async def lookup_channel(self, match):
+        """ Return Channel object for a given Slack ID or name """
+        return await self._slack.channel(match)
+
+    async def close(self):
+        self._closing = True
+        if self._connected:
+            # release sends held for a connection
+            self._connected.set()
+        for task in self._tasks:
+            task.cancel()
+        if self.ws:
+            await self.ws.close()
+
+        for _, future, _ in self._unacked.values():
+            if not future.done():
+                future.set_exception(errors.ExitError('stopped'))
+        self._broadcast(errors.ExitError('stopped'))
+
+        await self._slack.close()
+        log.debug('socket closed')
+
+    #######
+    # Internal Methods
+    #######
+
+    def _spawn(self, coro):
+        self._tasks.append(asyncio.ensure_future(coro))
+
+    async def _warmup(self):
+        """ load the directory, then release any held events for enrichment """
+        try:
+            if self._slack.load_snapshot():
+                self._warm.set()
+            await self._slack.preload()
+        except Exception as ex:
+            log.error('unable to load directory: %s' % ex)
+            self._broadcast(ex)
+            return
+
+        self._warm.set()
+        log.debug('directory loaded')
+
+    async def _enrich(self):
+        """ enrich and deliver received events, in the order received """
+        while True:
+            event = await self._pending.get()
+            await self._warm.wait()
+            start = time.perf_counter()
+            try:
+                event = await self._process_event(event)
+            except Exception as ex:
+                log.exception('error processing event: %s' % ex)
+                continue
+            self._enrich_time.since(start)
+            self._route(event)
+
+    async def _process_event(self, event):
+        """ Extend event object with User and Channel objects """
+        if self.track_changes and event.type in directory_event_types:
+            self._slack.apply_event(event)
+
+        event.team_id = self._slack.team_id
+        event.mentions_me = self.user.id in event.mention_ids
+
+        uid = item_id(event.get('user'))
+        if uid:
+            event.user = await self.lookup_user(uid)
+
+        cid = item_id(event.get('channel'))
+        if cid:
+            event.channel = await self.lookup_channel(cid)
+
+        event.mentions = [ await self.lookup_user(uid) for uid in event.mention_ids ]
+
+        return event
+
+    async def _keep_standby(self):
+        """ periodically fetch a standby websocket url, within rtm.connect's rate limit """
+        while True:
+            await asyncio.sleep(60)
+            try:
+                self._standby = (await self._slack.rtm_url(), time.time())
+            except Exception as ex:
+                log.warn('unable to fetch standby url: %s' % ex)
+
+    async def _ws_url(self):
+        """ return the standby websocket url if still valid, or a fresh one """
+        standby, self._standby = self._standby, None
+        if standby and time.time() - standby[1] < rtm_url_ttl:
+            log.debug('using standby websocket url')
+            return standby[0]
+        return await self._slack.rtm_url()
+
+    async def _open(self):
+        log.info('establishing websocket connection')
+        url = await self._ws_url()
+        session = self._ws_session or self._slack.session
+        self.ws = await session.ws_connect(url, heartbeat=10)
+        log.info('websocket connection established')
+        self._stats['connected_since'] = time.time()
+        self._connected.set()
+
+    async def _run(self):
+        while not self._closing:
+            async for msg in self.ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    self._event_handler(msg.data)
+                elif msg.type == aiohttp.WSMsgType.ERROR:
+                    log.critical('websocket error:\n %s' % self.ws.exception())
+                    break
+
+            if self._closing:
+                break
+            self._connected.clear()
+            log.warn('websocket connection closed')
+            dropped_at, dropped_perf = time.time(), time.perf_counter()
+
+            # reconnect immediately, backing off only after failed attempts
+            attempts = 0
+            while not self._closing:
+                try:
+                    await self._open()
+                    break
+                except Exception as ex:
+                    attempts += 1
+                    delay = self._slack.policy.backoff_time(attempts)
+                    log.error('unable to reconnect, retrying in %.1fs: %s' % (delay, ex))
+                    await asyncio.sleep(delay)
+            else:
+                break
+
+            self._gap(dropped_at, dropped_perf)
+            try:
+                await self._resend()
+            except Exception as ex:
+                log.exception('error resending messages: %s' % ex)
+
+    def _gap(self, dropped_at, dropped_perf):
+        """ record an outage and emit a connection_gap event for it """
+        duration = time.perf_counter() - dropped_perf
+        self._reconnect_time.observe(duration)
+        log.info('reconnected after %.3fs' % duration)
+
+        if self._wants('connection_gap'):
+            self._pending.put_nowait(SlackEvent({ 'type': 'connection_gap',
+                                                  'disconnected': dropped_at,
+                                                  'reconnected': time.time(),
+                                                  'duration': duration }))
+
+    async def _resend(self):
+        """
+        send messages awaiting a reply again, under new ids. a message may
+        be delivered twice, if its reply was lost with the connection
+        """
+        for msg_id in sorted(self._unacked):
+            # a send may time out and remove its own entry while others are resent
+            entry = self._unacked.pop(msg_id, None)
+            if entry is None or entry[1].done():
+                continue
+            msg, future, _ = entry
+            self._send_id += 1
+            msg.id = self._send_id
+            self._unacked[msg.id] = (msg, future, time.perf_counter())
+            try:
+                await self.ws.send_str(msg.json)
+            except Exception as ex:
+                log.error('unable to resend message: %s' % ex)
+
+    def _event_handler(self, event_json):
+        log.debug('event recieved: %s', event_json)
+
+        # discard events no one is subscribed to before parsing, where possible
+        etype = peek_type(event_json)
+        if etype is not None and not self._wants(etype):
+            self._stats['events_dropped'] += 1
+            return
+
+        event = SlackEvent.decode(event_json)
+        if event.type is None and 'reply_to' in event and self._ack(event):
+            return
+
+        if not self._wants(event.type):
+            self._stats['events_dropped'] += 1
+            return
+
+        self._pending.put_nowait(event)
+
+    def _ack(self, reply):
+        """ resolve a pending send from its reply, returning True if one matched """
+        entry = self._unacked.pop(reply.get('reply_to'), None)
+        if not entry:
+            return False
+
+        msg, future, sent_at = entry
+        self._ack_time.since(sent_at)
+        if future.done():
+            return True
+
+        if reply.get('ok', True):
+            msg.sent = True
+            msg.ts = reply.ts
+            future.set_result(msg)
+        else:
+            err = reply.get('error', {})
+            future.set_exception(errors.APIError('message %d not sent: %s' % (msg.id, err)))
+        return True
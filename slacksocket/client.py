@@ -1,15 +1,21 @@
 import ssl
-import json
 import time
 import signal
 import logging
 import websocket
-from threading import Thread
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeout
+from threading import Condition, Event, Thread, current_thread, main_thread
 
 import slacksocket.errors as errors
-from .config import event_types
-from .models import SlackEvent, SlackMsg
+from .config import directory_event_types, rtm_url_ttl
+from .ingest import Coalescer
+from .metrics import Registry
+from .models import SlackEvent, SlackMsg, item_id, peek_type
+from .recording import Recorder
+from .sender import Sender
+from .subscription import Dispatcher, Subscription, remaining
 from .webclient import WebClient
+from .workers import WorkerPool
 
 try:
     import queue as Queue # python3
@@ -22,52 +28,206 @@ STATE_STOPPED = 0
 STATE_INITIALIZED = 1
 STATE_CONNECTING = 2
 STATE_CONNECTED = 3
-STATE_UNCHANGED = 4
 
-class SlackSocket(object):
+def _resolve(future, result):
+    if future and not future.done():
+        try:
+            future.set_result(result)
+        except InvalidStateError:
+            pass
+
+def _fail(future, error):
+    if future and not future.done():
+        try:
+            future.set_exception(error)
+        except InvalidStateError:
+            pass
+
+class SlackSocket(Dispatcher):
     """
     SlackSocket class provides a streaming interface to the Slack Real Time
     Messaging API
     params:
      - slacktoken(str): token to authenticate with slack
      - connect_timeout(int): Optional maximum amount of time to wait for connection to succeed.
+     - track_changes(bool): Optional. Keep the user/channel directory current by applying
+       directory change events (team_join, channel_rename, etc.) as they are
+       received, rather than relying on full refreshes. default False
+     - snapshot_dir(str): Optional. Directory in which to keep a snapshot of the
+       user/channel directory. On startup, a snapshot newer than snapshot_max_age
+       seconds is loaded immediately and reconciled with the API in the background.
+     - snapshot_max_age(int): Optional. default 86400
+     - user_fields(list): Optional. If given, keep users as compact records holding only
+       these fields besides id and name; other fields are fetched on first access.
+     - channel_fields(list): Optional. As user_fields, for channels.
+     - workers(int): Optional. Number of threads enriching received events with
+       User and Channel objects. Events within a channel are always delivered in
+       the order received. default 1
+     - lazy(bool): Optional. Look up event User and Channel objects on first access
+       of event.user, event.channel or event.mentions rather than on receipt. default False
+     - catch_all(bool): Optional. Queue all received events for get_event() and events().
+       If False, only event types requested via subscribe() are processed. default True
+     - send_rate(float): Optional. Messages per second allowed per channel. default 1
+     - send_burst(int): Optional. Messages allowed per channel in a burst. default 3
+     - merge_sends(bool): Optional. Combine messages queued for the same channel into
+       a single message, one per line. default False
+     - handle_signals(bool): Optional. Close the socket on SIGINT and SIGTERM, replacing
+       any existing handlers. Ignored outside the main thread. default True
+     - request_timeout(float): Optional. Maximum time to wait for a response to a single
+       API request. Failed requests are retried with exponential backoff until
+       connect_timeout, if set, is exceeded. default 5
+     - api_url(str): Optional. Base url of the Slack web API. default https://slack.com/api/
+     - policy(RequestPolicy): Optional. Retry and rate limit policy for API requests.
+       default RequestPolicy()
+     - max_queue(int): Optional. Maximum events held in each subscription queue, including
+       the catch_all queue. When full, the overflow policy is applied. Events
+       awaiting enrichment are limited likewise, blocking the receiver when
+       full. default 0 (unbounded)
+     - overflow(str): Optional. Policy for events arriving for a full queue, one of
+       block, drop_oldest, priority or coalesce. See Subscription. default drop_oldest
+     - standby_url(bool): Optional. Keep a websocket url fetched in advance, so that
+       a dropped connection can be reopened without waiting on rtm.connect. Each
+       url is only valid for 30 seconds, and rtm.connect is limited to around one
+       call per minute, so a standby url is available for about half of all
+       reconnects. default False
+     - coalesce(dict): Optional. Time windows, in seconds, by event type, within which
+       repeated events of the type for the same user and channel are collapsed on
+       receipt, before parsing. Only the latest event in each window is delivered,
+       once the window closes. e.g. { 'presence_change': 5, 'user_typing': 3 }.
+       default None
+     - shared_path(str): Optional. Path of a SQLite database in which to keep the
+       user/channel directory, shared with other processes on the same machine,
+       such as WebClients in web workers. default None
+     - shared_role(str): Optional. writer, to refresh the shared directory from the
+       API, or reader, to only read it. One process per database should be the
+       writer. default writer
+     - record(str): Optional. Path of a file to append all received frames to, with
+       their receive times, for later replay. default None
+     - replay(Replay): Optional. Receive events from a recording rather than a live
+       websocket connection, closing the socket once all are delivered. Sent
+       messages are acknowledged without being sent. See recording.Replay. default None
     """
 
-    def __init__(self, slacktoken, connect_timeout=0):
+    def __init__(self, slacktoken, connect_timeout=0, track_changes=False,
+                 snapshot_dir=None, snapshot_max_age=86400,
+                 user_fields=None, channel_fields=None, workers=1, lazy=False,
+                 catch_all=True, send_rate=1.0, send_burst=3, merge_sends=False,
+                 handle_signals=True, request_timeout=5, standby_url=False,
+                 max_queue=0, overflow='drop_oldest', api_url=None, policy=None,
+                 coalesce=None, shared_path=None, shared_role='writer',
+                 record=None, replay=None):
         self.ws = None
+        self._replay = replay
+
+        # latency of each stage events pass through, from frame receipt to
+        # handoff to a consumer, and of sends, connections and pings
+        self.metrics = Registry()
+        self._receive_time = self.metrics.latency('receive')
+        self._parse_time = self.metrics.latency('parse')
+        self._queue_time = self.metrics.latency('queue_wait')
+        self._enrich_time = self.metrics.latency('enrich')
+        self._handoff_time = self.metrics.latency('handoff')
+        self._ping_rtt = self.metrics.latency('ping_rtt')
 
         # internal state
         self._internalq = Queue.Queue() # internal event queue
         self._state = None
+        self._state_cond = Condition()
         self._error = None
+        self._connect_time = self.metrics.latency('connect')
+
+        # reconnection tracking
+        self._attempts = 0 # consecutive failed connection attempts
+        self._dropped_at = None # time.time(), perf_counter() of last disconnect
+        self._reconnect_time = self.metrics.latency('reconnect')
+        self._standby = None # (websocket url, time fetched)
 
         # stats tracking
-        self._stats = {
-          'events_recieved': 0,
-          'events_dropped': 0,
-          'messages_sent': 0,
-          'connected_since': 0
-        }
+        self._received = self.metrics.counter('events_received')
+        self._sent = self.metrics.counter('messages_sent')
+        self._reconnects = self.metrics.counter('reconnects')
+        self._connected_since = 0
 
         self.timeout = connect_timeout
+        self.track_changes = track_changes
+        self.lazy = lazy
+
+        # events dropped by the socket, by reason. drops by each
+        # subscription's overflow policy are kept by the subscription
+        self._drops = { reason: self.metrics.counter('events_dropped', reason=reason)
+                        for reason in ('filtered', 'unsubscribed') }
+
+        Dispatcher.__init__(self, max_queue=max_queue, overflow=overflow)
+        if track_changes:
+            # directory changes are applied whether or not they are subscribed to
+            self._tracked = frozenset(directory_event_types)
+
+        # sent messages awaiting a reply are kept by id
+        self._send_id = 0
+        self._unacked = {}
+        self._ack_time = self.metrics.latency('ack')
+
+        self._validate_etypes(*(coalesce or ()))
+
+        self.catch_all = catch_all
+        self._eventq = Subscription(max_queue=max_queue, overflow=overflow)
+        if catch_all:
+            self._add_sub(self._eventq)
+
+        self._slack = WebClient(slacktoken, self.timeout,
+                                request_timeout=request_timeout,
+                                api_url=api_url,
+                                policy=policy,
+                                snapshot_dir=snapshot_dir,
+                                snapshot_max_age=snapshot_max_age,
+                                user_fields=user_fields,
+                                channel_fields=channel_fields,
+                                shared_path=shared_path,
+                                shared_role=shared_role)
+        self.team, self.user = self._slack.login()
+        self.metrics.labels['team_id'] = self._slack.team_id
+        self._slack.add_metrics(self.metrics)
 
-        self._eventq = Queue.Queue()
-        self._sendq = []
+        # threads and files are only created once logged in, so that
+        # a failed login leaves nothing running
+        self._recorder = Recorder(record) if record else None
 
-        self._slack = WebClient(slacktoken, self.timeout)
-        self.team, self.user = self._slack.login()
+        # outbound messages are written by the sender thread, which assigns message ids
+        self._sender = Sender(self._write, send_rate, send_burst, merge_sends)
+        self.metrics.add('send_wait', self._sender.send_time)
+
+        self._coalescer = None
+        if coalesce:
+            self._coalescer = Coalescer(coalesce, self._ingest)
+            for etype, counter in self._coalescer.suppressed.items():
+                self.metrics.add('events_suppressed', counter, type=etype)
+
+        # events are enriched off the websocket thread, waiting for
+        # the directory to be loaded before the first is processed
+        self._warm = Event()
+        self._pool = WorkerPool(self._deliver, workers, max_queue)
 
         # trap signals for graceful shutdown
-        signal.signal(signal.SIGINT, self._sig_handler)
-        signal.signal(signal.SIGTERM, self._sig_handler)
+        if handle_signals and current_thread() is main_thread():
+            signal.signal(signal.SIGINT, self._sig_handler)
+            signal.signal(signal.SIGTERM, self._sig_handler)
 
         self._thread = Thread(target=self._run)
         self._thread.start()
 
+        # load directory concurrently with websocket connection
+        self._loader = Thread(target=self._warmup)
+        self._loader.daemon = True
+        self._loader.start()
+
+        if standby_url:
+            t = Thread(target=self._keep_standby)
+            t.daemon = True
+            t.start()
+
         self._set_state(STATE_INITIALIZED)
         # wait for websocket connection to be established before returning
-        while self._state not in (STATE_STOPPED, STATE_CONNECTED):
-            time.sleep(.2)
+        self.wait_for_state(STATE_STOPPED, STATE_CONNECTED)
 
     def __enter__(self):
         return self
@@ -78,9 +238,74 @@ class SlackSocket(object):
     def stats(self):
         """
         Return a dictionary of SlackSocket stats, including the number
-        of messages sent and recieved
+        of messages sent and recieved and user/channel directory lookup stats
+        """
+        drops = { reason: c.value for reason, c in self._drops.items() }
+        for reason, n in self._sub_drops().items():
+            drops[reason] = drops.get(reason, 0) + n
+
+        received = self._received.value
+        return dict(events_received=received,
+                    events_recieved=received, # deprecated misspelling
+                    messages_sent=self._sent.value,
+                    connected_since=self._connected_since,
+                    reconnects=self._reconnects.value,
+                    events_dropped=sum(drops.values()),
+                    events_dropped_by_reason=drops,
+                    receive_time=self._receive_time.summary(),
+                    parse_time=self._parse_time.summary(),
+                    queue_wait_time=self._queue_time.summary(),
+                    handoff_time=self._handoff_time.summary(),
+                    ping_rtt=self._ping_rtt.summary(),
+                    connect_time=self._connect_time.summary(),
+                    reconnect_time=self._reconnect_time.summary(),
+                    events_suppressed=self._suppressed(),
+                    enrich_queue_depth=self._pool.depth(),
+                    enrich_time=self._enrich_time.summary(),
+                    send_queue_depth=self._sender.depth(),
+                    send_time=self._sender.send_time.summary(),
+                    messages_unacked=len(self._unacked),
+                    ack_time=self._ack_time.summary(),
+                    api=self._slack.policy.stats(),
+                    directory=self._slack.stats())
+
+    def prometheus(self):
+        """
+        Return all metrics in Prometheus text exposition format, with queue
+        depths, directory sizes and subscription drops as gauges
         """
-        return self._stats
+        gauges = [ ('enrich_queue_depth', {}, self._pool.depth()),
+                   ('send_queue_depth', {}, self._sender.depth()),
+                   ('messages_unacked', {}, len(self._unacked)) ]
+        if self._coalescer:
+            gauges.append(('events_held', {}, self._coalescer.depth()))
+        for name, stats in self._slack.stats().items():
+            if isinstance(stats, dict):
+                gauges.append(('directory_size', { 'directory': name }, stats['size']))
+        # subscriptions may be removed, taking their counts with them
+        for reason, n in sorted(self._sub_drops().items()):
+            gauges.append(('subscription_events_dropped', { 'reason': reason }, n))
+        return self.metrics.prometheus(gauges)
+
+    def wait_for_state(self, *states, timeout=None):
+        """
+        Block until the socket enters one of the given states, returning
+        True, or False if the timeout is exceeded first
+        params:
+         - states(int): STATE_* constants to wait for
+         - timeout(int): Max time, in seconds, to wait
+        """
+        with self._state_cond:
+            return self._state_cond.wait_for(lambda: self._state in states, timeout)
+
+    def wait_for_directory(self, timeout=None):
+        """
+        Block until the user/channel directory is loaded, from a snapshot or
+        the API, returning True, or False if the timeout is exceeded first
+        params:
+         - timeout(int): Max time, in seconds, to wait
+        """
+        return self._warm.wait(timeout)
 
     def get_event(self, *etypes, timeout=None):
         """
@@ -91,24 +316,56 @@ class SlackSocket(object):
            a listing of valid event types.
          - timeout(int): Max time, in seconds, to block waiting for new event
         """
+        if not self.catch_all:
+            raise errors.ConfigError('get_event() requires catch_all, see subscribe()')
+
         self._validate_etypes(*etypes)
-        start = time.time()
-        e = self._eventq.get(timeout=timeout)
+        deadline = time.time() + timeout if timeout is not None else None
 
-        if isinstance(e, Exception):
-            raise e
+        while True:
+            e = self._eventq.get_event(timeout=remaining(deadline))
+            self._handed_off(e)
 
-        self._stats['events_recieved'] += 1
-        if etypes and e.type not in etypes:
-            if timeout:
-                timeout -= time.time() - start
-            log.debug('ignoring filtered event: {}'.format(e.json))
-            self._stats['events_dropped'] += 1
-            return self.get_event(*etypes, timeout=timeout)
+            self._received.inc()
+            if not etypes or e.type in etypes:
+                return e
 
-        return e
+            log.debug('ignoring filtered %s event', e.type)
+            self._drops['filtered'].inc()
 
-    def events(self, *etypes, idle_timeout=None):
+    def get_events(self, *etypes, max_n=100, timeout=None):
+        """
+        Return a list of up to max_n events received, taken from the queue at
+        once, or block until at least one is received. Returns an empty list
+        if timeout is exceeded.
+         - etypes(str): If defined, Slack event type(s) not matching
+           the filter will be ignored.
+         - max_n(int): Maximum number of events to return. default 100
+         - timeout(int): Max time, in seconds, to block waiting for new events
+        """
+        if not self.catch_all:
+            raise errors.ConfigError('get_events() requires catch_all, see subscribe()')
+
+        self._validate_etypes(*etypes)
+        deadline = time.time() + timeout if timeout is not None else None
+
+        while True:
+            batch = self._eventq.get_events(max_n, timeout=remaining(deadline))
+            if not batch:
+                return batch
+
+            for e in batch:
+                self._handed_off(e)
+
+            self._received.inc(len(batch))
+            if etypes:
+                matched = [ e for e in batch if e.type in etypes ]
+                self._drops['filtered'].inc(len(batch) - len(matched))
+                batch = matched
+            if batch:
+                return batch
+
+    def events(self, *etypes, idle_timeout=None, batch=0):
         """
         returns a blocking generator yielding Slack event objects
         params:
@@ -117,7 +374,17 @@ class SlackSocket(object):
            a listing of valid event types.
          - idle_timeout(int): optional maximum amount of time (in seconds)
            to wait between events before returning
+         - batch(int): if given, yield lists of up to this many events,
+           as returned by get_events()
         """
+        if batch:
+            while self._state != STATE_STOPPED:
+                events = self.get_events(*etypes, max_n=batch, timeout=idle_timeout)
+                if not events:
+                    log.info('idle timeout reached for events()')
+                    return
+                yield events
+            return
 
         while self._state != STATE_STOPPED:
             try:
@@ -126,7 +393,7 @@ class SlackSocket(object):
                 log.info('idle timeout reached for events()')
                 return
 
-    def send_msg(self, text, channel, confirm=True):
+    def send_msg(self, text, channel, confirm=True, timeout=None):
         """
         Send a message to a channel or group via Slack RTM socket, returning
         the resulting message object
@@ -135,23 +402,38 @@ class SlackSocket(object):
          - text(str): Message text to send
          - channel(Channel): Target channel
          - confirm(bool): If True, wait for a reply-to confirmation before returning.
+         - timeout(int): Max time, in seconds, to wait for confirmation
         """
-
-        self._send_id += 1
-        msg = SlackMsg(self._send_id, channel.id, text)
-        self.ws.send(msg.json)
-        self._stats['messages_sent'] += 1
-
-        if confirm:
-            # Wait for confirmation our message was received
-            for e in self.events():
-                if e.get('reply_to') == self._send_id:
-                    msg.sent = True
-                    msg.ts = e.ts
-                    return msg
-        else:
+        if not confirm:
+            msg = SlackMsg(None, channel.id, text)
+            self._sender.put(channel.id, (msg, [], None))
             return msg
 
+        future = self.submit_msg(text, channel, timeout)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            _fail(future, errors.TimeoutError('no reply to message'))
+            return future.result()
+
+    def submit_msg(self, text, channel, timeout=None):
+        """
+        Queue a message to a channel or group for sending via Slack RTM socket,
+        returning a Future resolving to the sent message object once Slack
+        replies.
+
+        params:
+         - text(str): Message text to send
+         - channel(Channel): Target channel
+         - timeout(int): Max time, in seconds, to wait for a reply before
+           failing the future with a TimeoutError
+        """
+        msg = SlackMsg(None, channel.id, text)
+        future = Future()
+        deadline = time.time() + timeout if timeout else None
+        self._sender.put(channel.id, (msg, [future], deadline))
+        return future
+
     def lookup_user(self, match):
         """ Return User object for a given Slack ID or name """
         return self._slack.user(match)
@@ -172,110 +454,369 @@ class SlackSocket(object):
         """ notify manager thread of state change """
         self._internalq.put(state)
 
+    def _enter_state(self, state):
+        """ apply a state change and wake any waiters, run by the manager thread """
+        with self._state_cond:
+            self._state = state
+            self._state_cond.notify_all()
+
+    def _warmup(self):
+        """ load the directory, then release any held events for enrichment """
+        try:
+            if self._slack.load_snapshot():
+                # reconcile with the api after releasing held events
+                self._warm.set()
+            self._slack.preload()
+        except Exception as ex:
+            self._error = ex
+            self.close()
+            return
+
+        self._warm.set()
+        log.debug('directory loaded')
+
+    def _deliver(self, event):
+        """ enrich and queue a received event, run by pool workers """
+        self._warm.wait()
+        start = time.perf_counter()
+        if event._stamp is not None:
+            self._queue_time.observe(start - event._stamp)
+        event = self._process_event(event)
+        event._stamp = time.perf_counter()
+        self._enrich_time.observe(event._stamp - start)
+        self._route(event)
+
+    def _handed_off(self, event):
+        """ record the time an event waited in the queue for a consumer """
+        if isinstance(event, SlackEvent) and event._stamp is not None:
+            self._handoff_time.since(event._stamp)
+            event._stamp = None
+
+    def _suppressed(self):
+        """ return events collapsed by the coalescer, by type """
+        if not self._coalescer:
+            return {}
+        return { etype: c.value for etype, c in self._coalescer.suppressed.items() }
+
+    def _sub_drops(self):
+        """ return events dropped by subscription overflow policies, by reason """
+        drops = {}
+        for sub in list(self._subs):
+            for reason, n in sub.dropped.items():
+                drops[reason] = drops.get(reason, 0) + n
+        return drops
+
+    def _write(self, queued):
+        """ write queued messages for a channel to the socket, run by the sender thread """
+        now = time.time()
+        for _, futures, deadline in queued:
+            if deadline and deadline <= now:
+                for future in futures:
+                    _fail(future, errors.TimeoutError('no reply to message'))
+        # drop confirmed sends which have already failed
+        queued = [ q for q in queued if not q[1] or not all(f.done() for f in q[1]) ]
+        if not queued:
+            return
+
+        msg = queued[0][0]
+        if len(queued) > 1:
+            text = '\n'.join(m.payload['text'] for m, _, _ in queued)
+            msg = SlackMsg(None, msg.payload['channel'], text)
+
+        self._send_id += 1
+        msg.id = self._send_id
+
+        futures = [ f for _, fs, _ in queued for f in fs ]
+        if futures:
+            deadline = min((d for _, _, d in queued if d), default=None)
+            self._unacked[msg.id] = (msg, futures, time.perf_counter(), deadline)
+
+        try:
+            self.ws.send(msg.json)
+        except Exception as ex:
+            # hold sends until the connection is reestablished
+            log.warn('unable to send message, requeueing: %s' % ex)
+            self._sender.pause()
+            self._unacked.pop(msg.id, None)
+            # requeue each item written, confirmed or not, in its original order
+            for item in reversed(queued):
+                self._sender.put(msg.payload['channel'], item, front=True)
+            return
+        self._sent.inc()
+
+    def _ack(self, reply):
+        """ resolve a pending send from its reply, returning True if one matched """
+        entry = self._unacked.pop(reply.get('reply_to'), None)
+        if not entry:
+            return False
+
+        msg, futures, sent_at, _ = entry
+        self._ack_time.since(sent_at)
+        if reply.get('ok', True):
+            msg.sent = True
+            msg.ts = reply.ts
+            for future in futures:
+                _resolve(future, msg)
+        else:
+            err = errors.APIError('message %d not sent: %s' % (msg.id, reply.get('error', {})))
+            for future in futures:
+                _fail(future, err)
+        return True
+
+    def _expire(self, msg_id, error=None):
+        entry = self._unacked.pop(msg_id, None)
+        if entry:
+            error = error or errors.TimeoutError('no reply to message %d' % msg_id)
+            for future in entry[1]:
+                _fail(future, error)
+
+    def _requeue_sends(self):
+        """
+        return sends awaiting a reply to the front of the send queue, to be
+        sent again on reconnection. a send may be delivered twice, if its
+        reply was lost with the connection
+        """
+        for msg_id in sorted(self._unacked, reverse=True):
+            entry = self._unacked.pop(msg_id, None)
+            if entry:
+                msg, futures, _, deadline = entry
+                self._sender.put(msg.payload['channel'], (msg, futures, deadline), front=True)
+
+    def _expire_sends(self):
+        """ fail pending sends whose reply timeout has passed """
+        now = time.time()
+        for msg_id, entry in list(self._unacked.items()):
+            if entry[3] and entry[3] <= now:
+                self._expire(msg_id)
+
     def _sig_handler(self, signal, frame):
         log.debug("caugh signal, exiting")
         self.close()
 
     def _process_event(self, event):
         """ Extend event object with User and Channel objects """
-        if event.get('user'):
-            event.user = self.lookup_user(event.get('user'))
-
-        if event.get('channel'):
-            event.channel = self.lookup_channel(event.get('channel'))
+        if self.track_changes and event.type in directory_event_types:
+            self._slack.apply_event(event)
 
-        if self.user.id in event.mentions:
-            event.mentions_me = True
+        event.team_id = self._slack.team_id
+        event.mentions_me = self.user.id in event.mention_ids
 
-        event.mentions = [ self.lookup_user(uid) for uid in event.mentions ]
+        event.bind(self)
+        if not self.lazy:
+            event.resolve()
 
         return event
 
-    @staticmethod
-    def _validate_etypes(*etypes):
-        if not etypes:
-            return
-
-        invalid = [ f for f in etypes if f not in event_types ]
-        if invalid:
-            raise errors.ConfigError('unknown event type %s\n \
-                         see https://api.slack.com/events' % invalid)
-
     #######
     # Websocket Handlers
     #######
 
     def _run(self):
         conn_start = None
+        conn_deadline = None
 
         while True:
-            # wait for notification of state change
-            state = self._internalq.get()
-            if state != STATE_UNCHANGED:
-                self._state = state
+            # wait for notification of state change, waking at least once a
+            # second to expire sends, or when the connect timeout is reached
+            wait = 1
+            if conn_deadline is not None:
+                wait = min(wait, max(conn_deadline - time.time(), 0))
+            try:
+                state = self._internalq.get(timeout=wait)
+            except Queue.Empty:
+                self._expire_sends()
+                if conn_deadline is not None and time.time() >= conn_deadline:
+                    self._error = errors.TimeoutError('connection timeout exceeded')
+                    self._set_state(STATE_STOPPED)
+                continue
+
+            self._enter_state(state)
 
             if self._state == STATE_STOPPED:
                 if self.ws:
                     self.ws.close()
 
-                # break any running event loops
+                # break any running event loops. this also ends subscriptions,
+                # releasing any workers blocked on a full queue
+                self._broadcast(self._error or errors.ExitError('stopped'))
+
+                if self._coalescer:
+                    self._coalescer.stop()
+                self._pool.stop()
+                for _, futures, _ in self._sender.stop():
+                    for future in futures:
+                        _fail(future, errors.ExitError('stopped'))
+                for msg_id in list(self._unacked):
+                    self._expire(msg_id, errors.ExitError('stopped'))
+                if self._recorder:
+                    self._recorder.close()
+
                 if self._error:
-                    self._eventq.put(self._error)
                     raise self._error
-                else:
-                    self._eventq.put(errors.ExitError('stopped'))
                 break
 
             if self._state == STATE_INITIALIZED:
+                self._sender.pause()
                 if not conn_start:
-                    conn_start = time.time()
+                    conn_start = time.perf_counter()
+                    if self.timeout:
+                        conn_deadline = time.time() + self.timeout
                 self._wsthread = Thread(target=self._open)
                 self._wsthread.daemon = True
                 self._wsthread.start()
 
             if self._state == STATE_CONNECTING:
-                if self.timeout and time.time() - conn_start >= self.timeout:
-                    self._error = errors.TimeoutError('connection timeout exceeded')
-                    self.close()
                 log.info('establishing websocket connection')
-                time.sleep(.5)
-                self._set_state(STATE_UNCHANGED)
 
             if self._state == STATE_CONNECTED:
                 log.info('websocket connection established')
-                conn_start = None
-                self._stats['connected_since'] = time.time()
+                self._sender.resume()
+                self._connect_time.since(conn_start)
+                if self._connected_since:
+                    self._reconnects.inc()
+                conn_start = conn_deadline = None
+                self._connected_since = time.time()
 
         log.debug('worker stopped')
 
+    def _keep_standby(self):
+        """ periodically fetch a standby websocket url, within rtm.connect's rate limit """
+        while not self.wait_for_state(STATE_STOPPED, timeout=60):
+            if self._state != STATE_CONNECTED:
+                continue
+            try:
+                self._standby = (self._slack.rtm_url(), time.time())
+            except Exception as ex:
+                log.warn('unable to fetch standby url: %s' % ex)
+
+    def _ws_url(self):
+        """ return the standby websocket url if still valid, or a fresh one """
+        standby, self._standby = self._standby, None
+        if standby and time.time() - standby[1] < rtm_url_ttl:
+            log.debug('using standby websocket url')
+            return standby[0]
+        return self._slack.rtm_url()
+
     def _open(self):
-        self._send_id = 0 # reset id for sending messages with each new socket
         self._set_state(STATE_CONNECTING)
 
+        if self._replay:
+            self._run_replay()
+            return
+
+        # reconnect immediately, backing off only after failed attempts
+        if self._attempts:
+            delay = self._slack.policy.backoff_time(self._attempts)
+            log.info('reconnecting in %.1fs' % delay)
+            if self.wait_for_state(STATE_STOPPED, timeout=delay):
+                return
+
         try:
-            ws_url = self._slack.rtm_url()
+            ws_url = self._ws_url()
         except Exception as ex:
             self._error = ex
-            self.close()
+            self._set_state(STATE_STOPPED)
+            return
 
         self.ws = websocket.WebSocketApp(ws_url,
                                          keep_running=False,
                                          on_message=self._event_handler,
                                          on_error=self._error_handler,
                                          on_open=self._open_handler,
-                                         on_close=self._exit_handler)
+                                         on_close=self._exit_handler,
+                                         on_pong=self._pong_handler)
+        self._attempts += 1
         self.ws.run_forever(ping_interval=10, ping_timeout=5,
                 sslopt={'cert_reqs': ssl.CERT_NONE})
+
+        if self._state == STATE_STOPPED:
+            return
+        if not self._attempts:
+            # connection was established, then dropped
+            self._dropped_at = (time.time(), time.perf_counter())
+            self._sender.pause()
+            self._requeue_sends()
         self._set_state(STATE_INITIALIZED)
 
+    def _run_replay(self):
+        """ receive events from a recording, stopping once all are delivered """
+        self.ws = self._replay
+        # replies to sends made once connected need somewhere to go
+        self._replay.bind(self._event_handler)
+        self._open_handler()
+        n = self._replay.run()
+        if self._state == STATE_STOPPED:
+            return
+
+        if self._coalescer:
+            self._coalescer.flush()
+        self._pool.join()
+        log.info('replay of %d events complete' % n)
+        self._set_state(STATE_STOPPED)
+
     def _event_handler(self, event_json):
-        log.debug('event recieved: %s' % event_json)
-        event = SlackEvent(json.loads(event_json))
-        self._eventq.put(self._process_event(event))
+        start = time.perf_counter()
+        log.debug('event recieved: %s', event_json)
+        if self._recorder:
+            self._recorder.record(event_json)
+
+        # discard events no one is subscribed to before parsing, where possible
+        etype = peek_type(event_json)
+        if etype is not None and not self._wants(etype):
+            self._drops['unsubscribed'].inc()
+            return
+
+        if self._coalescer and self._coalescer.hold(etype, event_json):
+            return
+        self._ingest(event_json, start)
+
+    def _ingest(self, event_json, start=None):
+        """ parse a received frame and submit it for enrichment """
+        if start is None:
+            start = time.perf_counter()
+
+        event = SlackEvent.decode(event_json)
+        event._stamp = time.perf_counter()
+        self._parse_time.observe(event._stamp - start)
+
+        if event.type is None and 'reply_to' in event:
+            # replies recorded in another session match no send, so are dropped on replay
+            if self._ack(event) or self._replay:
+                return
+
+        if not self._wants(event.type):
+            self._drops['unsubscribed'].inc()
+            return
+
+        self._pool.submit(item_id(event.get('channel')), event)
+        self._receive_time.since(start)
 
     def _open_handler(self):
+        self._attempts = 0
+        if self._dropped_at:
+            self._gap(*self._dropped_at)
+            self._dropped_at = None
         self._set_state(STATE_CONNECTED)
 
+    def _gap(self, dropped_at, dropped_perf):
+        """ record an outage and emit a connection_gap event for it """
+        duration = time.perf_counter() - dropped_perf
+        self._reconnect_time.observe(duration)
+        log.info('reconnected after %.3fs' % duration)
+
+        if self._wants('connection_gap'):
+            event = SlackEvent({ 'type': 'connection_gap',
+                                 'disconnected': dropped_at,
+                                 'reconnected': time.time(),
+                                 'duration': duration })
+            self._pool.submit(None, event)
+
+    def _pong_handler(self, data):
+        # the websocket app records send and receipt times of its pings
+        rtt = self.ws.last_pong_tm - self.ws.last_ping_tm
+        if rtt >= 0:
+            self._ping_rtt.observe(rtt)
+
     def _error_handler(self, error):
         log.critical('websocket error:\n %s' % error)
 
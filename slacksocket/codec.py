@@ -0,0 +1,49 @@
+"""
+JSON encoding and decoding for events, messages and API responses, using the
+fastest library available: orjson, then ujson, then the stdlib json module.
+"""
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+log = logging.getLogger('slacksocket')
+
+name = None
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj).decode('utf-8')
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj, ensure_ascii=False)
+
+_codecs = { 'orjson': (orjson, lambda: (orjson.loads, _orjson_dumps)),
+            'ujson': (ujson, lambda: (ujson.loads, _ujson_dumps)),
+            'json': (json, lambda: (json.loads, json.dumps)) }
+
+def available():
+    """ Return the names of usable codecs, fastest first """
+    return [ n for n in ('orjson', 'ujson', 'json') if _codecs[n][0] is not None ]
+
+def use(codec):
+    """
+    Select the JSON library used by slacksocket
+    params:
+     - codec(str): one of orjson, ujson or json
+    """
+    global name, loads, dumps
+    if codec not in available():
+        raise ImportError('json codec %s is not available' % codec)
+    loads, dumps = _codecs[codec][1]()
+    name = codec
+    log.debug('using %s json codec' % codec)
+
+use(available()[0])
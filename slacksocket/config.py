@@ -1,10 +1,53 @@
-slack = 'https://slack.com/api/'
+import os
 
-urls = { 'test': slack + 'auth.test',
-         'rtm': slack + 'rtm.start',
-         'users': slack + 'users.list',
-         'im.open': slack + 'im.open',
-         'convos': slack + 'conversations.list' }
+# base url of the slack web api. may be overridden with the SLACKSOCKET_API_URL
+# environment variable, or per client with the api_url option
+api_url = os.environ.get('SLACKSOCKET_API_URL', 'https://slack.com/api/')
+
+api_methods = { 'test': 'auth.test',
+                'rtm': 'rtm.connect',
+                'users': 'users.list',
+                'users.info': 'users.info',
+                'im.open': 'im.open',
+                'convos': 'conversations.list',
+                'convos.info': 'conversations.info' }
+
+def make_urls(base=None):
+    """ Return a dict of web api method urls for the given base url """
+    base = base or api_url
+    if not base.endswith('/'):
+        base += '/'
+    return { k: base + m for k, m in api_methods.items() }
+
+urls = make_urls()
+
+# web api rate limit tiers, as given in https://api.slack.com/docs/rate-limits
+# tier -> (requests per minute, burst). a minute's allowance may be used at
+# once, so that paginated loads are not spread out needlessly
+rate_tiers = { 1: (1, 3),
+               2: (20, 20),
+               3: (50, 50),
+               4: (100, 100) }
+
+method_tiers = { 'auth.test': 4,
+                 'rtm.connect': 1,
+                 'users.list': 2,
+                 'users.info': 4,
+                 'im.open': 3,
+                 'conversations.list': 2,
+                 'conversations.info': 3 }
+
+# paginated list methods, which are not paced up front: Slack tolerates
+# bursts of page requests, replying 429 with a Retry-After when exceeded
+paged_methods = frozenset([ 'users.list', 'conversations.list' ])
+
+# items requested per page of list methods. conversations.list returns
+# up to 999; users.list is recommended to be paged 200 at a time
+page_limits = { 'users': 200,
+                'convos': 999 }
+
+# time, in seconds, for which a websocket url from rtm.connect is valid
+rtm_url_ttl = 30
 
 # event types as given in https://api.slack.com/events
 event_types = [ 'hello',
@@ -59,7 +102,27 @@ event_types = [ 'hello',
                 'bot_changed',
                 'accounts_changed',
                 'user_typing',
-                'team_migration_started' ]
+                'team_migration_started',
+                # synthetic event emitted by slacksocket on reconnection
+                'connection_gap' ]
+
+# event queue overflow policies
+overflow_policies = [ 'block', 'drop_oldest', 'priority', 'coalesce' ]
+
+# priority of event types shed first by the 'priority' overflow policy,
+# lowest first. all other event types have priority 2
+event_priority = { 'user_typing': 0,
+                   'presence_change': 1,
+                   'manual_presence_change': 1 }
+
+# event types carrying user/channel directory changes
+directory_event_types = [ 'team_join',
+                          'user_change',
+                          'channel_created',
+                          'channel_rename',
+                          'channel_deleted',
+                          'im_created',
+                          'group_joined' ]
 
 def validate_filters(self, filters):
     if filters == 'all':
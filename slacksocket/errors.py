@@ -1,6 +1,13 @@
 class APIError(RuntimeError):
     """ Error response from Slack API """
 
+class RateLimitError(APIError):
+    """ Request rate limited by Slack API """
+
+    def __init__(self, msg, retry_after=None):
+        APIError.__init__(self, msg)
+        self.retry_after = retry_after
+
 class ConfigError(NameError):
     """ Invalid name """
 
@@ -0,0 +1,370 @@
+"""
+Local stand-in for the Slack web and RTM APIs, for tests and benchmarks.
+Uses only the standard library.
+
+    with FakeSlack(users=1000) as fake:
+        s = SlackSocket('any-token', api_url=fake.api_url)
+        fake.replay([{ 'type': 'message', 'channel': 'C00000000', 'text': 'hi' }])
+        print(s.get_event())
+"""
+import sys
+import time
+import base64
+import socket
+import struct
+import hashlib
+import logging
+from threading import Condition, Lock, Thread
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+from . import codec
+
+log = logging.getLogger('slacksocket')
+
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+class FakeSlack(object):
+    """
+    Serves auth.test, rtm.connect, users.list, users.info, conversations.list
+    (with cursor pagination), conversations.info and im.open over HTTP, and
+    an RTM websocket which replies to sent messages and replays events on
+    demand. Any token is accepted.
+    params:
+     - users(int): number of users in the directory. default 50
+     - channels(int): number of public channels in the directory. default 20
+     - ims(int): number of im channels in the directory. default 5
+     - page_size(int): maximum items per page of list methods. default 200
+     - host(str): address to listen on. default 127.0.0.1
+     - latency(float): time, in seconds, to delay each api response by, as
+       a stand-in for network and server time. default 0
+    attributes:
+     - calls(dict): number of requests served, by api method
+    """
+
+    def __init__(self, users=50, channels=20, ims=5, page_size=200, host='127.0.0.1',
+                 latency=0):
+        self.host = host
+        self.latency = latency
+        self.page_size = page_size
+        self.users = [ make_user(i) for i in range(users) ]
+        self.channels = [ make_channel(i) for i in range(channels) ] + \
+                        [ make_im(i) for i in range(min(ims, users)) ]
+        self.calls = {}
+
+        self._clients = []
+        self._cond = Condition()
+        self._http = None
+        self._ws = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.stop()
+
+    @property
+    def api_url(self):
+        """ base url to pass as a client's api_url """
+        return 'http://%s:%d/api/' % (self.host, self._http.server_port)
+
+    @property
+    def ws_url(self):
+        return 'ws://%s:%d/' % (self.host, self._ws.getsockname()[1])
+
+    def start(self):
+        """ Start serving on ephemeral ports, returning this server """
+        self._http = _HTTPServer((self.host, 0), _APIHandler)
+        self._http.fake = self
+        self._ws = socket.socket()
+        self._ws.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._ws.bind((self.host, 0))
+        self._ws.listen(128)
+
+        for target in (self._http.serve_forever, self._accept):
+            t = Thread(target=target)
+            t.daemon = True
+            t.start()
+        return self
+
+    def stop(self):
+        """ Stop serving and close all websocket connections """
+        self._http.shutdown()
+        self._http.server_close()
+        self._ws.close()
+        for client in self.clients():
+            client.close()
+
+    def clients(self):
+        """ Return the currently connected websocket clients """
+        with self._cond:
+            return [ c for c in self._clients if not c.closed ]
+
+    def wait_clients(self, n=1, timeout=None):
+        """ Block until at least n websocket clients are connected """
+        with self._cond:
+            return self._cond.wait_for(
+                    lambda: sum(not c.closed for c in self._clients) >= n, timeout)
+
+    def send(self, event):
+        """ Send an event to all connected websocket clients """
+        frame = _frame(codec.dumps(event).encode('utf-8'))
+        for client in self.clients():
+            client.send_frame(frame)
+
+    def replay(self, events, rate=None):
+        """
+        Send events to all connected websocket clients, in order
+        params:
+         - events(iterable): event dicts, or callables returning one at the
+           time it is sent
+         - rate(float): events per second to send at. default None (as fast
+           as possible)
+        """
+        start = time.perf_counter()
+        for i, event in enumerate(events):
+            if rate:
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.send(event() if callable(event) else event)
+
+    def disconnect(self):
+        """ Drop all websocket connections, as on a server-side close """
+        for client in self.clients():
+            client.close()
+
+    #######
+    # Internal Methods
+    #######
+
+    def _count(self, method):
+        with self._cond:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def _page(self, items, key, params):
+        cursor = int(params.get('cursor') or 0)
+        limit = min(int(params.get('limit') or self.page_size), self.page_size)
+        nxt = cursor + limit
+        return { 'ok': True,
+                 key: items[cursor:nxt],
+                 'response_metadata': { 'next_cursor': str(nxt) if nxt < len(items) else '' } }
+
+    def _api(self, method, params):
+        """ return the response to an api call """
+        self._count(method)
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == 'auth.test':
+            return { 'ok': True, 'user': 'bot', 'user_id': 'U00000000',
+                     'team': 'fake', 'team_id': 'T00000000' }
+        if method == 'rtm.connect':
+            return { 'ok': True, 'url': self.ws_url,
+                     'self': { 'id': 'U00000000', 'name': 'bot' },
+                     'team': { 'id': 'T00000000', 'name': 'fake' } }
+        if method == 'users.list':
+            return self._page(self.users, 'members', params)
+        if method == 'conversations.list':
+            return self._page(self.channels, 'channels', params)
+        if method == 'users.info':
+            match = [ u for u in self.users if u['id'] == params.get('user') ]
+            if match:
+                return { 'ok': True, 'user': match[0] }
+            return { 'ok': False, 'error': 'user_not_found' }
+        if method == 'conversations.info':
+            match = [ c for c in self.channels if c['id'] == params.get('channel') ]
+            if match:
+                return { 'ok': True, 'channel': match[0] }
+            return { 'ok': False, 'error': 'channel_not_found' }
+        if method == 'im.open':
+            return { 'ok': True, 'channel': 'D' + params.get('user', 'U')[1:] }
+        return { 'ok': False, 'error': 'unknown_method' }
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._ws.accept()
+            except OSError:
+                return # listening socket closed
+            client = _WSClient(conn, self)
+            t = Thread(target=client.run)
+            t.daemon = True
+            t.start()
+
+    def _connected(self, client):
+        with self._cond:
+            self._clients = [ c for c in self._clients if not c.closed ] + [client]
+            self._cond.notify_all()
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients closed mid-request, e.g. a socket closed while loading
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            HTTPServer.handle_error(self, request, client_address)
+
+class _APIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, which would otherwise stall
+    # each keep-alive response on the client's delayed ack
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = { k: v[0] for k, v in parse_qs(url.query).items() }
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length).decode('utf-8')
+            params.update({ k: v[0] for k, v in parse_qs(body).items() })
+
+        res = self.server.fake._api(url.path.rsplit('/', 1)[-1], params)
+        body = codec.dumps(res).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+class _WSClient(object):
+    """ server side of a single websocket connection """
+
+    def __init__(self, conn, fake):
+        self.conn = conn
+        self.fake = fake
+        self.closed = False
+        self._lock = Lock()
+
+    def send_frame(self, frame):
+        try:
+            with self._lock:
+                self.conn.sendall(frame)
+        except OSError:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.conn.close()
+
+    def run(self):
+        try:
+            self._handshake()
+            self.fake._connected(self)
+            self.send_frame(_frame(b'{"type":"hello"}'))
+            self._read()
+        except (OSError, EOFError, ValueError):
+            pass
+        finally:
+            self.close()
+
+    def _handshake(self):
+        req = b''
+        while b'\r\n\r\n' not in req:
+            data = self.conn.recv(4096)
+            if not data:
+                raise EOFError
+            req += data
+
+        key = None
+        for line in req.split(b'\r\n'):
+            if line.lower().startswith(b'sec-websocket-key:'):
+                key = line.split(b':', 1)[1].strip()
+        if key is None:
+            raise ValueError('not a websocket request')
+
+        accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+        self.conn.sendall(b'HTTP/1.1 101 Switching Protocols\r\n'
+                          b'Upgrade: websocket\r\n'
+                          b'Connection: Upgrade\r\n'
+                          b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+
+    def _recv(self, n):
+        buf = b''
+        while len(buf) < n:
+            data = self.conn.recv(n - len(buf))
+            if not data:
+                raise EOFError
+            buf += data
+        return buf
+
+    def _read(self):
+        while not self.closed:
+            b0, b1 = self._recv(2)
+            opcode = b0 & 0x0f
+            length = b1 & 0x7f
+            if length == 126:
+                length = struct.unpack('!H', self._recv(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', self._recv(8))[0]
+            mask = self._recv(4) if b1 & 0x80 else b'\0\0\0\0'
+            data = bytes(b ^ mask[i % 4] for i, b in enumerate(self._recv(length)))
+
+            if opcode == 0x8: # close
+                self.send_frame(_frame(data, 0x8))
+                return
+            if opcode == 0x9: # ping
+                self.send_frame(_frame(data, 0xa))
+            elif opcode == 0x1:
+                self._reply(codec.loads(data.decode('utf-8')))
+
+    def _reply(self, msg):
+        if msg.get('type') == 'ping':
+            reply = { 'type': 'pong', 'reply_to': msg.get('id') }
+        elif 'id' in msg:
+            reply = { 'ok': True, 'reply_to': msg['id'],
+                      'ts': '%.6f' % time.time(), 'text': msg.get('text') }
+        else:
+            return
+        self.send_frame(_frame(codec.dumps(reply).encode('utf-8')))
+
+def _frame(data, opcode=0x1):
+    """ encode an unmasked server websocket frame """
+    n = len(data)
+    if n < 126:
+        header = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return header + data
+
+def make_user(i):
+    return { 'id': 'U%08d' % i,
+             'team_id': 'T00000000',
+             'name': 'user%d' % i,
+             'deleted': False,
+             'real_name': 'Fake User %d' % i,
+             'tz': 'America/New_York',
+             'profile': { 'real_name': 'Fake User %d' % i,
+                          'display_name': 'user%d' % i,
+                          'status_text': '',
+                          'image_48': 'https://example.com/%d_48.png' % i },
+             'is_bot': False,
+             'updated': 1502138686 }
+
+def make_channel(i):
+    return { 'id': 'C%08d' % i,
+             'name': 'channel%d' % i,
+             'is_channel': True,
+             'is_private': False,
+             'created': 1449252889,
+             'topic': { 'value': '', 'creator': '', 'last_set': 0 } }
+
+def make_im(i):
+    return { 'id': 'D%08d' % i,
+             'is_im': True,
+             'user': 'U%08d' % i,
+             'created': 1449252889 }
@@ -0,0 +1,126 @@
+import time
+import heapq
+import logging
+from threading import Condition, Thread
+
+from .metrics import Counter
+from .models import peek_ids, peek_name, peek_users
+
+log = logging.getLogger('slacksocket')
+
+class Coalescer(object):
+    """
+    Collapses repeated raw event frames of the given types before they are
+    parsed. The first frame for a type, user and channel is held for the
+    type's window; frames for the same type, user and channel arriving
+    within it replace the held frame, which is passed on when the window
+    closes. pref_change frames are keyed by pref name, and batched
+    presence_change frames by their list of users. Held frames are passed on from the coalescer's thread, so may
+    be delivered after events of other types received later.
+    params:
+     - windows(dict): window, in seconds, by event type
+     - emit(callable): called with each frame as it is passed on
+    attributes:
+     - suppressed(dict): Counter of frames replaced within a window, by event type
+    """
+
+    def __init__(self, windows, emit):
+        self.windows = dict(windows)
+        self.suppressed = { etype: Counter() for etype in self.windows }
+        self._emit = emit
+
+        self._held = {} # (type, user, channel) -> frame
+        self._due = [] # heap of (deadline, key)
+        self._cond = Condition()
+        self._stopped = False
+
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def hold(self, etype, frame):
+        """
+        Hold a frame of a coalesced type, returning True, or False if its
+        type is not coalesced and it should be passed on now
+        """
+        window = self.windows.get(etype)
+        if window is None:
+            return False
+
+        key = _key(etype, frame)
+        if key is None:
+            return False
+        with self._cond:
+            if key in self._held:
+                self._held[key] = frame
+                replaced = True
+            else:
+                self._held[key] = frame
+                heapq.heappush(self._due, (time.perf_counter() + window, key))
+                self._cond.notify()
+                replaced = False
+
+        if replaced:
+            self.suppressed[etype].inc()
+        return True
+
+    def depth(self):
+        """ Return the number of frames held """
+        with self._cond:
+            return len(self._held)
+
+    def flush(self):
+        """ Pass on all held frames now """
+        with self._cond:
+            frames = [ self._held.pop(key) for _, key in sorted(self._due) ]
+            self._due = []
+        for frame in frames:
+            self._emit(frame)
+
+    def stop(self):
+        """ Stop passing on frames, discarding any held """
+        with self._cond:
+            self._stopped = True
+            self._held.clear()
+            self._cond.notify()
+
+    #######
+    # Internal Methods
+    #######
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if not self._due:
+                        self._cond.wait()
+                        continue
+                    wait = self._due[0][0] - time.perf_counter()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                if self._stopped:
+                    return
+
+                now = time.perf_counter()
+                frames = []
+                while self._due and self._due[0][0] <= now:
+                    _, key = heapq.heappop(self._due)
+                    frames.append(self._held.pop(key))
+
+            for frame in frames:
+                try:
+                    self._emit(frame)
+                except Exception as ex:
+                    log.exception('error passing on coalesced event: %s' % ex)
+
+def _key(etype, frame):
+    """ return the key of frames collapsed together, or None if the frame is passed on """
+    if etype == 'pref_change':
+        name = peek_name(frame)
+        return None if name is None else (etype, name)
+
+    users = peek_users(frame)
+    if users is not None:
+        return (etype, frozenset(users))
+    return (etype,) + peek_ids(frame)
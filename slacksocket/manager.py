@@ -0,0 +1,192 @@
+import signal
+import asyncio
+import logging
+
+import slacksocket.errors as errors
+from .aio import AsyncSlackSocket, aiohttp, _require_aiohttp
+
+log = logging.getLogger('slacksocket')
+
+class SocketManager(object):
+    """
+    Holds RTM connections for many workspaces on a single event loop. All
+    sockets share one bounded HTTP connection pool for API requests, and
+    their events are merged into one stream, each tagged with its team_id.
+
+        async with SocketManager() as mgr:
+            await mgr.connect(tokens)
+            async for event in mgr.events('message'):
+                await mgr[event.team_id].send_msg('hello', event.channel)
+
+    params:
+     - etypes(list): Optional. Slack event types to receive. Other types are
+       discarded by each socket on receipt. If empty, all events are received.
+     - max_connections(int): Optional. Maximum concurrent HTTP connections for
+       API requests, across all sockets. default 100
+     - **opts: options passed to each AsyncSlackSocket
+    """
+
+    def __init__(self, etypes=(), max_connections=100, **opts):
+        _require_aiohttp()
+        AsyncSlackSocket._validate_etypes(*etypes)
+
+        self.etypes = tuple(etypes)
+        self.max_connections = max_connections
+        self._opts = opts
+
+        self._sockets = {}
+        self._forwarders = {}
+        self._events = None
+        self._http = None
+        self._ws = None
+        self._closing = False
+
+    def __getitem__(self, team_id):
+        return self._sockets[team_id]
+
+    def __len__(self):
+        return len(self._sockets)
+
+    def __iter__(self):
+        return iter(list(self._sockets.values()))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.close()
+
+    async def add(self, slacktoken):
+        """ Connect a socket for the given token, returning it """
+        if self._closing:
+            raise errors.ExitError('manager is closing')
+        self._start()
+
+        sock = AsyncSlackSocket(slacktoken, catch_all=False, session=self._http,
+                                ws_session=self._ws, **self._opts)
+        # subscribe before connecting, so no events are missed
+        sub = sock.subscribe(*self.etypes)
+        await sock.connect()
+
+        old = self._sockets.get(sock.team_id)
+        if old:
+            log.warn('replacing existing socket for team %s' % sock.team_id)
+            await self.remove(sock.team_id)
+
+        self._sockets[sock.team_id] = sock
+        self._forwarders[sock.team_id] = asyncio.ensure_future(self._forward(sock, sub))
+        log.info('added socket for team %s (%s)' % (sock.team, sock.team_id))
+        return sock
+
+    async def connect(self, tokens):
+        """
+        Connect sockets for all given tokens concurrently, returning them.
+        Tokens which fail to connect are logged and skipped.
+        """
+        results = await asyncio.gather(*[ self.add(t) for t in tokens ],
+                                       return_exceptions=True)
+        socks = []
+        for res in results:
+            if isinstance(res, Exception):
+                log.error('unable to connect socket: %s' % res)
+            else:
+                socks.append(res)
+        return socks
+
+    async def remove(self, team_id):
+        """ Close and remove the socket for a team """
+        sock = self._sockets.pop(team_id)
+        self._forwarders.pop(team_id).cancel()
+        await sock.close()
+
+    async def get_event(self, *etypes, timeout=None):
+        """
+        Return a single event object from any socket, or wait until one
+        is received and return it
+         - etypes(str): If defined, Slack event type(s) not matching
+           the filter will be ignored.
+         - timeout(int): Max time, in seconds, to wait for new event
+        """
+        self._start()
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+
+        while True:
+            wait = max(deadline - loop.time(), 0) if deadline is not None else None
+            e = await asyncio.wait_for(self._events.get(), wait)
+            if isinstance(e, Exception):
+                raise e
+            if not etypes or e.type in etypes:
+                return e
+
+    async def events(self, *etypes, idle_timeout=None):
+        """
+        returns an async generator yielding Slack event objects from all sockets
+        params:
+         - etypes(str): If defined, Slack event type(s) not matching
+           the filter will be ignored.
+         - idle_timeout(int): optional maximum amount of time (in seconds)
+           to wait between events before returning
+        """
+        while not self._closing:
+            try:
+                yield await self.get_event(*etypes, timeout=idle_timeout)
+            except asyncio.TimeoutError:
+                log.info('idle timeout reached for events()')
+                return
+
+    def stats(self):
+        """ Return a dictionary of stats for each socket, by team_id """
+        return { team_id: sock.stats() for team_id, sock in self._sockets.items() }
+
+    def handle_signals(self):
+        """ Close all sockets on SIGINT or SIGTERM """
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, lambda: asyncio.ensure_future(self.close()))
+
+    async def close(self):
+        """ Close all sockets and shared connections """
+        if self._closing:
+            return
+        self._closing = True
+
+        for task in self._forwarders.values():
+            task.cancel()
+        await asyncio.gather(*[ s.close() for s in self._sockets.values() ],
+                             return_exceptions=True)
+        self._sockets.clear()
+        self._forwarders.clear()
+
+        if self._http:
+            await self._http.close()
+            await self._ws.close()
+        if self._events:
+            self._events.put_nowait(errors.ExitError('stopped'))
+        log.debug('manager closed')
+
+    #######
+    # Internal Methods
+    #######
+
+    def _start(self):
+        """ create loop-bound resources on first use """
+        if self._events is not None:
+            return
+
+        self._events = asyncio.Queue()
+        # websockets hold their connection for their lifetime, so are kept
+        # out of the bounded pool used for api requests
+        self._http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections))
+        self._ws = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+
+    async def _forward(self, sock, sub):
+        """ copy events from a socket subscription to the merged stream """
+        try:
+            async for event in sub.events():
+                self._events.put_nowait(event)
+        except errors.ExitError:
+            pass
+        except Exception as ex:
+            log.error('socket for team %s failed: %s' % (sock.team_id, ex))
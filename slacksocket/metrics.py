@@ -0,0 +1,218 @@
+import time
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+
+# upper bounds, in seconds, of latency histogram buckets
+BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025,
+           .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+class Latency(object):
+    """
+    Thread-safe running summary and histogram of observed durations
+    params:
+     - window(int): number of most recent observations to compute percentiles over
+     - buckets(tuple): histogram bucket upper bounds, in seconds
+    attributes:
+     - count(int): number of observations
+     - total(float): sum of all observed durations, in seconds
+     - max(float): longest observed duration, in seconds
+     - hook(callable): called with each observed duration, if set
+    """
+
+    def __init__(self, window=1024, buckets=BUCKETS):
+        self._lock = Lock()
+        self._recent = deque(maxlen=window)
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.hook = None
+
+    def observe(self, secs):
+        with self._lock:
+            self.count += 1
+            self.total += secs
+            if secs > self.max:
+                self.max = secs
+            self._recent.append(secs)
+            self._counts[bisect_left(self.buckets, secs)] += 1
+        if self.hook:
+            self.hook(secs)
+
+    def since(self, start):
+        """ observe the time elapsed since a time.perf_counter() start value """
+        self.observe(time.perf_counter() - start)
+
+    def summary(self):
+        with self._lock:
+            avg = self.total / self.count if self.count else 0.0
+            recent = sorted(self._recent)
+            return { 'count': self.count, 'avg': avg, 'max': self.max,
+                     'p50': _percentile(recent, .5),
+                     'p90': _percentile(recent, .9),
+                     'p99': _percentile(recent, .99) }
+
+    def histogram(self):
+        """ Return cumulative (upper bound, count) pairs, ending with +Inf """
+        with self._lock:
+            counts = list(self._counts)
+        total = 0
+        hist = []
+        for le, n in zip(self.buckets + (float('inf'),), counts):
+            total += n
+            hist.append((le, total))
+        return hist
+
+class Counter(object):
+    """
+    Thread-safe monotonic counter
+    attributes:
+     - hook(callable): called with each increment, if set
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.value = 0
+        self.hook = None
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+        if self.hook:
+            self.hook(n)
+
+class Hook(object):
+    """
+    Interface for receiving metrics as they are recorded, to forward them to
+    a tracing or metrics system. Methods are called on the thread recording
+    the metric, so should return quickly.
+    """
+
+    def observe(self, name, secs, labels):
+        """ a duration was observed for a latency metric """
+
+    def inc(self, name, n, labels):
+        """ a counter was incremented """
+
+class Registry(object):
+    """
+    Named latency and counter metrics, with optional labels, exported in
+    Prometheus text format and passed to hooks as they are recorded
+    params:
+     - prefix(str): prefix of exported metric names. default slacksocket
+     - labels(dict): labels applied to all exported metrics
+    """
+
+    def __init__(self, prefix='slacksocket', labels=None):
+        self.prefix = prefix
+        self.labels = labels or {}
+        self._metrics = {} # (name, labels) -> Latency or Counter
+        self._hooks = ()
+        self._lock = Lock()
+
+    def latency(self, name, **labels):
+        """ Return the Latency metric of a name and labels, creating it if needed """
+        return self._get(name, labels, Latency)
+
+    def counter(self, name, **labels):
+        """ Return the Counter metric of a name and labels, creating it if needed """
+        return self._get(name, labels, Counter)
+
+    def add(self, name, metric, **labels):
+        """ Register an existing Latency or Counter under a name and labels """
+        key = (name, tuple(sorted(labels.items())))
+        self._bind(key, metric)
+        with self._lock:
+            self._metrics[key] = metric
+        return metric
+
+    def add_hook(self, hook):
+        """ Pass all subsequently recorded metrics to a Hook """
+        with self._lock:
+            self._hooks += (hook,)
+
+    def remove_hook(self, hook):
+        with self._lock:
+            self._hooks = tuple(h for h in self._hooks if h is not hook)
+
+    def prometheus(self, gauges=()):
+        """
+        Return all metrics in Prometheus text exposition format. Latencies are
+        exported as <prefix>_<name>_seconds histograms, and counters as
+        <prefix>_<name>_total
+        params:
+         - gauges(list): additional (name, labels, value) gauges to export
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items(), key=lambda m: m[0])
+
+        lines = []
+        typed = set()
+
+        def declare(name, mtype):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s %s' % (name, mtype))
+
+        for (name, labels), metric in metrics:
+            labels = dict(self.labels, **dict(labels))
+            if isinstance(metric, Latency):
+                mname = '%s_%s_seconds' % (self.prefix, name)
+                declare(mname, 'histogram')
+                for le, n in metric.histogram():
+                    bucket = dict(labels, le='+Inf' if le == float('inf') else repr(le))
+                    lines.append('%s_bucket%s %d' % (mname, _labels(bucket), n))
+                lines.append('%s_sum%s %r' % (mname, _labels(labels), metric.total))
+                lines.append('%s_count%s %d' % (mname, _labels(labels), metric.count))
+            else:
+                mname = '%s_%s_total' % (self.prefix, name)
+                declare(mname, 'counter')
+                lines.append('%s%s %d' % (mname, _labels(labels), metric.value))
+
+        for name, labels, value in gauges:
+            mname = '%s_%s' % (self.prefix, name)
+            declare(mname, 'gauge')
+            lines.append('%s%s %r' % (mname, _labels(dict(self.labels, **labels)), value))
+
+        return '\n'.join(lines) + '\n'
+
+    #######
+    # Internal Methods
+    #######
+
+    def _get(self, name, labels, mtype):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = mtype()
+                self._bind(key, metric)
+        return metric
+
+    def _bind(self, key, metric):
+        """ forward a metric's observations to hooks """
+        name, labels = key[0], dict(key[1])
+        if isinstance(metric, Latency):
+            def hook(secs):
+                for h in self._hooks:
+                    h.observe(name, secs, labels)
+        else:
+            def hook(n):
+                for h in self._hooks:
+                    h.inc(name, n, labels)
+        metric.hook = hook
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in sorted(labels.items()))
+
+def _escape(val):
+    return str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
@@ -1,10 +1,76 @@
 import re
 import sys
-import json
+import logging
+from threading import Lock
 from time import time
 
+from . import codec
+
+log = logging.getLogger('slacksocket')
+
 mentions_re = re.compile('<@(\w+)>')
 
+# matches an event type given as the first key of a raw event frame
+type_re = re.compile(r'^\s*\{\s*"type"\s*:\s*"([^"\\]*)"')
+
+# match the first user and channel ids given in a raw event frame
+user_re = re.compile(r'"user"\s*:\s*"([^"\\]*)"')
+channel_re = re.compile(r'"channel"\s*:\s*"([^"\\]*)"')
+
+# match the name of a raw pref_change frame, and the users of a batched presence_change
+name_re = re.compile(r'"name"\s*:\s*"([^"\\]*)"')
+users_re = re.compile(r'"users"\s*:\s*\[([^\]]*)\]')
+string_re = re.compile(r'"([^"\\]*)"')
+
+# marks an event attribute not yet looked up
+_unresolved = object()
+
+# serialize loads of compact item fields by item id, without a lock per item
+_load_locks = [ Lock() for _ in range(64) ]
+
+def _intern(val):
+    return sys.intern(val) if isinstance(val, str) else val
+
+def peek_type(frame):
+    """
+    Return the type of a raw JSON event frame without decoding it, or None if
+    it cannot be determined cheaply
+    """
+    m = type_re.match(frame)
+    return m.group(1) if m else None
+
+def peek_ids(frame):
+    """
+    Return the user and channel ids of a raw JSON event frame without
+    decoding it, as found first in the frame. Either may be None
+    """
+    user = user_re.search(frame)
+    channel = channel_re.search(frame)
+    return (user.group(1) if user else None,
+            channel.group(1) if channel else None)
+
+def peek_users(frame):
+    """
+    Return the ids listed in a raw JSON event frame's users field, as in
+    batched presence_change events, without decoding it. None if not given
+    """
+    users = users_re.search(frame)
+    return string_re.findall(users.group(1)) if users else None
+
+def peek_name(frame):
+    """ Return the first name given in a raw JSON event frame, or None """
+    name = name_re.search(frame)
+    return name.group(1) if name else None
+
+def item_id(val):
+    """
+    Return the id of a user or channel field. Some events (team_join,
+    channel_created, etc.) carry a full object in place of an id
+    """
+    if isinstance(val, dict):
+        return val.get('id', '')
+    return val
+
 class DirItem(dict):
     """
     Generic Slack directory item
@@ -28,6 +94,101 @@ class Channel(DirItem):
     def __repr__(self):
         return f'Channel({self.name} <{self.id}>)'
 
+class CompactItem(object):
+    """
+    Compact Slack directory item, retaining only its id, name and a given set
+    of fields from the API response. Other fields are fetched on first access
+    via `loader`, if provided, and otherwise treated as missing, as they are
+    if the loader fails.
+    params:
+     - data(dict)
+     - fields(list): names of fields to retain
+     - loader(callable): optional function returning the full item data for an id
+    attributes:
+     - id(str): Slack ID
+     - name(str): Slack human-readable name
+    """
+    __slots__ = ('id', 'name', '_fields', '_loader')
+
+    def __init__(self, data, fields=(), loader=None):
+        self.id = _intern(data.get('id', 'unknown'))
+        self.name = _intern(data.get('name', 'unknown'))
+        self._fields = { k: data[k] for k in fields if k in data } or None
+        self._loader = loader
+
+    @classmethod
+    def from_row(cls, id, name, fields, loader=None):
+        """ build an item from fields already limited to those retained """
+        item = cls.__new__(cls)
+        item.id = _intern(id)
+        item.name = _intern(name)
+        item._fields = fields or None
+        item._loader = loader
+        return item
+
+    def __str__(self):
+        return self.name
+
+    def __getitem__(self, key):
+        if key == 'id':
+            return self.id
+        if key == 'name':
+            return self.name
+        if self._fields and key in self._fields:
+            return self._fields[key]
+        if self._loader:
+            self._load()
+            return self[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """ names of fields currently held, without loading any """
+        return ['id', 'name'] + list(self._fields or ())
+
+    def _load(self):
+        # concurrent callers wait for the first to load, and the loader is
+        # only cleared once fields are set, so none sees them missing
+        with _load_locks[hash(self.id) % len(_load_locks)]:
+            loader = self._loader
+            if loader is None:
+                return # loaded by another thread while we waited
+            try:
+                data = loader(self.id)
+            except Exception as ex:
+                # fields not retained are treated as missing from then on
+                log.warn('unable to load fields of %s: %s' % (self.id, ex))
+            else:
+                fields = dict(data, **(self._fields or {}))
+                fields.pop('id', None)
+                fields.pop('name', None)
+                self._fields = fields
+            self._loader = None
+
+class CompactUser(CompactItem):
+    __slots__ = ()
+
+    def __repr__(self):
+        return f'User({self.name} <{self.id}>)'
+
+class CompactChannel(CompactItem):
+    __slots__ = ()
+
+    def __repr__(self):
+        return f'Channel({self.name} <{self.id}>)'
+
 class SlackEvent(dict):
     """
     Event received from the Slack RTM API
@@ -40,28 +201,86 @@ class SlackEvent(dict):
      - ts(float): UTC event timestamp
      - metions(list): List of Slack User objects mentioned in event text
      - mentions_me(bool): Whether this message @mentions the logged in bot/user
+     - team_id(str): ID of the team the event was received from
+     - raw(str): JSON frame the event was decoded from, if any
+
+    Once bound to a resolver, user, channel and mentions are looked up on
+    first access and the result kept.
     """
 
-    def __init__(self, data):
+    def __init__(self, data, raw=None):
         super(SlackEvent, self).__init__(data)
+        self.raw = raw
 
         self.type = self.get('type')
         self.ts = self.get('ts', int(time()))
 
-        self.mentions = mentions_re.findall(self.get('text', ''))
+        self.mention_ids = mentions_re.findall(self.get('text', ''))
         self.mentions_me = False
+        self.team_id = None
+
+        self._stamp = None # perf_counter() on entering a pipeline stage
+
+        self._resolver = None
+        self._user = None
+        self._channel = None
+        self._mentions = self.mention_ids
 
-        self.user = None
-        self.channel = None
+    def bind(self, resolver):
+        """
+        Resolve user, channel and mentions through the given resolver on
+        access, via its lookup_user and lookup_channel methods
+        """
+        self._resolver = resolver
+        self._user = self._channel = self._mentions = _unresolved
 
-        if isinstance(self.channel, dict):
-            # if channel is newly created, a channel object is returned from api
-            # instead of a channel id
-            self.channel = self.channel.get('id')
+    def resolve(self):
+        """ Resolve user, channel and mentions now """
+        return self.user, self.channel, self.mentions
+
+    @property
+    def user(self):
+        if self._user is _unresolved:
+            uid = item_id(self.get('user'))
+            self._user = self._resolver.lookup_user(uid) if uid else None
+        return self._user
+
+    @user.setter
+    def user(self, val):
+        self._user = val
+
+    @property
+    def channel(self):
+        if self._channel is _unresolved:
+            cid = item_id(self.get('channel'))
+            self._channel = self._resolver.lookup_channel(cid) if cid else None
+        return self._channel
+
+    @channel.setter
+    def channel(self, val):
+        self._channel = val
+
+    @property
+    def mentions(self):
+        if self._mentions is _unresolved:
+            self._mentions = [ self._resolver.lookup_user(uid) for uid in self.mention_ids ]
+        return self._mentions
+
+    @mentions.setter
+    def mentions(self, val):
+        self._mentions = val
 
     @property
     def json(self):
-        return json.dumps(self)
+        """ event as JSON, reusing the frame it was received as where available """
+        if self.raw is not None:
+            return self.raw
+        return codec.dumps(self)
+
+    @classmethod
+    def decode(cls, frame):
+        """ Return a SlackEvent decoded from a raw JSON frame """
+        return cls(codec.loads(frame), frame)
 
 class SlackMsg(object):
     """
@@ -76,8 +295,20 @@ class SlackMsg(object):
 
     def __init__(self, id, channel, text):
         self.sent = False
+        self.ts = None
         self.payload = {'id': id,
                         'type': 'message',
                         'text': text,
                         'channel': channel}
-        self.json = json.dumps(self.payload)
+
+    @property
+    def id(self):
+        return self.payload['id']
+
+    @id.setter
+    def id(self, val):
+        self.payload['id'] = val
+
+    @property
+    def json(self):
+        return codec.dumps(self.payload)
@@ -0,0 +1,149 @@
+"""
+Recording of received RTM frames, and replay of recordings in place of a
+live websocket connection.
+
+A recording is an append-only file of a header followed by one record per
+frame: its receive time (a float64 epoch time), its length (uint32), and
+the frame as UTF-8 encoded JSON.
+
+    s = SlackSocket('xoxb-token', record='rtm.rec')
+    ...
+    s = SlackSocket('xoxb-token', replay=Replay('rtm.rec', speed=10))
+"""
+import os
+import mmap
+import time
+import struct
+import logging
+from threading import Lock
+
+import slacksocket.errors as errors
+from . import codec
+
+log = logging.getLogger('slacksocket')
+
+MAGIC = b'SLKREC1\n'
+RECORD = struct.Struct('<dI') # receive time, frame length
+
+class Recorder(object):
+    """
+    Appends frames to a recording file, creating it if needed
+    params:
+     - path(str): path of the recording
+     - buffering(int): bytes of frames held before writing to the file.
+       default 65536
+    """
+
+    def __init__(self, path, buffering=65536):
+        self.path = path
+        self._lock = Lock()
+        self._f = open(path, 'ab', buffering)
+        if self._f.tell() == 0:
+            self._f.write(MAGIC)
+        else:
+            _check_header(path)
+
+    def record(self, frame, ts=None):
+        """ Append a frame, received at ts (default now) """
+        if isinstance(frame, str):
+            frame = frame.encode('utf-8')
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            self._f.write(RECORD.pack(ts, len(frame)))
+            self._f.write(frame)
+
+    def flush(self):
+        with self._lock:
+            self._f.flush()
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+class Replay(object):
+    """
+    Replays a recording to a SlackSocket in place of its websocket. The file
+    is memory-mapped and read as it is replayed, so recordings need not fit
+    in memory. Sent messages are acknowledged immediately, with an ok reply.
+    params:
+     - path(str): path of the recording
+     - speed(float): multiple of the recorded pace to replay frames at, e.g. 10.
+       default None (as fast as possible)
+    """
+
+    def __init__(self, path, speed=None):
+        _check_header(path)
+        self.path = path
+        self.speed = speed
+
+        self._on_message = None
+        self._stopped = False
+
+    def __iter__(self):
+        """ yield (receive time, frame) for each recorded frame """
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= len(MAGIC):
+                return
+            buf = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                pos = len(MAGIC)
+                while pos + RECORD.size <= size:
+                    ts, length = RECORD.unpack_from(buf, pos)
+                    pos += RECORD.size
+                    if pos + length > size:
+                        log.warn('recording %s ends with a partial frame' % self.path)
+                        return
+                    yield ts, buf[pos:pos + length].decode('utf-8')
+                    pos += length
+            finally:
+                buf.close()
+
+    def bind(self, on_message):
+        """
+        Set the function frames and replies to sent messages are passed to,
+        before sends may be made
+        """
+        self._on_message = on_message
+
+    def run(self, on_message=None):
+        """
+        Pass each recorded frame to on_message, or the function given to
+        bind(), in order, until the recording is exhausted or close() is
+        called. Returns the number of frames replayed.
+        """
+        if on_message is not None:
+            self._on_message = on_message
+        on_message = self._on_message
+        start = first = None
+        n = 0
+
+        for ts, frame in self:
+            if self._stopped:
+                break
+            if self.speed:
+                if start is None:
+                    start, first = time.perf_counter(), ts
+                delay = start + (ts - first) / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            on_message(frame)
+            n += 1
+
+        return n
+
+    def send(self, data):
+        """ acknowledge a message sent during replay """
+        msg = codec.loads(data)
+        reply = { 'ok': True, 'reply_to': msg.get('id'),
+                  'ts': '%.6f' % time.time(), 'text': msg.get('text') }
+        if self._on_message:
+            self._on_message(codec.dumps(reply))
+
+    def close(self):
+        self._stopped = True
+
+def _check_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise errors.ConfigError('%s is not a slacksocket recording' % path)
@@ -0,0 +1,136 @@
+import random
+import logging
+from threading import Lock
+
+import slacksocket.errors as errors
+from .config import method_tiers, paged_methods, rate_tiers
+from .metrics import Counter
+from .sender import TokenBucket
+
+log = logging.getLogger('slacksocket')
+
+class RequestPolicy(object):
+    """
+    Retry and rate limit policy for Slack API requests. The policy only
+    computes delays; callers wait for them, so the same policy serves both
+    WebClient and AsyncWebClient.
+    params:
+     - backoff(float): delay, in seconds, before the first retry of a failed
+       request. Doubled for each further attempt. default 1
+     - max_backoff(float): maximum delay between retries. default 60
+     - jitter(bool): randomize retry delays between half and all of their
+       nominal value, so that clients do not retry in lockstep. default True
+     - rate_limit(bool): pace requests to each API method within its Slack
+       rate limit tier. Paginated list methods are only held back after a
+       429 response, for its Retry-After. default True
+
+    Slack applies rate limits per workspace, so requests are paced per token
+    and method, and a policy may be shared between clients of many workspaces.
+    """
+
+    def __init__(self, backoff=1.0, max_backoff=60.0, jitter=True, rate_limit=True):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+
+        self._lock = Lock()
+        self._buckets = {} # (token, api method) -> TokenBucket
+
+        self.requests = Counter()
+        self.retries = Counter()
+        self.rate_limited = Counter()
+        self.throttled = Counter()
+
+    def wait_time(self, method, now, token=None):
+        """
+        Reserve a request to an API method, returning the time to wait
+        before making it
+        params:
+         - method(str): API method name
+         - now(float): current time.monotonic()
+         - token(str): token the request is made with
+        """
+        self.requests.inc()
+        if not self.rate_limit:
+            return 0
+
+        with self._lock:
+            bucket = self._bucket(token, method, now)
+            delay = bucket.delay(now)
+            if method not in paged_methods:
+                bucket.take()
+
+        if delay:
+            self.throttled.inc()
+            log.debug('throttling %s request for %.2fs' % (method, delay))
+        return delay
+
+    def retry_time(self, method, attempt, error, now, token=None):
+        """
+        Return the time to wait before retrying a failed request, or None
+        if the error should not be retried
+        params:
+         - method(str): API method name
+         - attempt(int): number of attempts made so far
+         - error(Exception): error raised by the last attempt
+         - now(float): current time.monotonic()
+         - token(str): token the request was made with
+        """
+        if isinstance(error, errors.RateLimitError):
+            self.rate_limited.inc()
+            delay = error.retry_after
+            if delay is None:
+                delay = self.backoff_time(attempt)
+            # hold further requests to this method until the limit resets
+            with self._lock:
+                self._hold(token, method, delay, now)
+        elif isinstance(error, errors.APIError):
+            return None
+        else:
+            delay = self.backoff_time(attempt)
+
+        self.retries.inc()
+        return delay
+
+    def stats(self):
+        return { 'requests': self.requests.value,
+                 'retries': self.retries.value,
+                 'rate_limited': self.rate_limited.value,
+                 'throttled': self.throttled.value }
+
+    def backoff_time(self, attempt):
+        """ Return the time to wait after the given number of failed attempts """
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(delay / 2, delay)
+        return delay
+
+    #######
+    # Internal Methods
+    #######
+
+    def _bucket(self, token, method, now):
+        bucket = self._buckets.get((token, method))
+        if bucket is None:
+            per_min, burst = rate_tiers[method_tiers.get(method, 3)]
+            bucket = self._buckets[(token, method)] = TokenBucket(per_min / 60.0, burst)
+            bucket.stamp = now
+        return bucket
+
+    def _hold(self, token, method, delay, now):
+        """ empty a method's bucket so that its next token is due after delay """
+        bucket = self._bucket(token, method, now)
+        bucket.delay(now)
+        bucket.tokens = min(bucket.tokens, 1 - delay * bucket.rate)
+
+def api_method(url):
+    """ API method name of a Slack web API url """
+    return url.rsplit('/', 1)[-1]
+
+def retry_after(value):
+    """ parse a Retry-After header value, in seconds """
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        return None
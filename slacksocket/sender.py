@@ -0,0 +1,139 @@
+import time
+import logging
+from collections import OrderedDict
+from threading import Condition, Thread
+
+from .metrics import Latency
+
+log = logging.getLogger('slacksocket')
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter
+    params:
+     - rate(float): tokens added per second
+     - burst(int): maximum tokens held
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def delay(self, now):
+        """ time until a token is available, or 0 if one is available now """
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class Sender(object):
+    """
+    Outbound message scheduler. Queued items are passed to `write` by a
+    single writer thread, at most `rate` per second per channel with bursts
+    of up to `burst`. Channels with queued items are served in turn.
+    params:
+     - write(callable): called with a list of items queued for one channel;
+       the list holds one item unless merge is set
+     - rate(float): items per second allowed per channel
+     - burst(int): items allowed per channel in a burst
+     - merge(bool): pass all items queued for a channel to `write` at once
+    """
+
+    def __init__(self, write, rate=1.0, burst=3, merge=False):
+        self._write = write
+        self.rate = rate
+        self.burst = burst
+        self.merge = merge
+
+        self._cond = Condition()
+        self._queues = OrderedDict() # channel -> list of (item, queued at)
+        self._buckets = {}
+        self._paused = True
+        self._stopped = False
+        self.send_time = Latency()
+
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, channel, item, front=False):
+        """ Queue an item for a channel, ahead of any queued items if front is set """
+        with self._cond:
+            q = self._queues.setdefault(channel, [])
+            if front:
+                q.insert(0, (item, time.perf_counter()))
+                self._queues.move_to_end(channel, last=False)
+            else:
+                q.append((item, time.perf_counter()))
+            self._cond.notify()
+
+    def depth(self):
+        """ Return the number of items waiting to be written """
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def pause(self):
+        """ Hold writes until resume() is called """
+        with self._cond:
+            self._paused = True
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+            self._cond.notify()
+
+    def stop(self):
+        """ Stop the writer thread, returning any items not yet written """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            items = [ item for q in self._queues.values() for item, _ in q ]
+            self._queues.clear()
+        return items
+
+    def _next(self):
+        """ wait for and pop the items to write next, or None if stopped """
+        with self._cond:
+            while not self._stopped:
+                wait = None
+                if not self._paused:
+                    now = time.monotonic()
+                    for channel, q in self._queues.items():
+                        bucket = self._buckets.get(channel)
+                        if bucket is None:
+                            bucket = self._buckets[channel] = TokenBucket(self.rate, self.burst)
+
+                        delay = bucket.delay(now)
+                        if delay:
+                            wait = delay if wait is None else min(wait, delay)
+                            continue
+
+                        bucket.take()
+                        if self.merge or len(q) == 1:
+                            del self._queues[channel]
+                            return q
+                        # serve other channels before this one again
+                        self._queues.move_to_end(channel)
+                        return [ q.pop(0) ]
+
+                self._cond.wait(wait)
+
+    def _run(self):
+        while True:
+            queued = self._next()
+            if queued is None:
+                return
+
+            for _, stamp in queued:
+                self.send_time.since(stamp)
+            try:
+                self._write([ item for item, _ in queued ])
+            except Exception as ex:
+                log.exception('error writing message: %s' % ex)
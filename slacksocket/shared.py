@@ -0,0 +1,183 @@
+import time
+import sqlite3
+import logging
+from threading import Lock, local
+
+from . import codec
+from .metrics import Counter, Latency
+
+log = logging.getLogger('slacksocket')
+
+class SharedDirectory(object):
+    """
+    Directory of items kept in a local SQLite database, which may be shared
+    by many processes: one refreshing it and the rest only reading. A
+    refresh replaces all items in a single transaction, so readers never
+    see one in progress. Items read are cached per thread until the
+    database is next changed, so repeated lookups are served from memory.
+    params:
+     - path(str): path of the database file, created if needed
+     - table(str): name of the table holding this directory's items
+     - factory(callable): function building an item from its stored data
+     - check_interval(float): time, in seconds, between checks for changes
+       made by other processes. default 1
+    """
+
+    def __init__(self, path, table, factory, check_interval=1.0):
+        self.path = path
+        self.table = table
+        self.check_interval = check_interval
+        self._factory = factory
+        self._local = local()
+        self._lock = Lock() # serializes writers within this process
+        self._generation = 0 # writes made within this process
+        self._hits = Counter()
+        self._misses = Counter()
+        self._latency = Latency()
+
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS %s '
+                         '(id TEXT PRIMARY KEY, name TEXT, data TEXT)' % table)
+            conn.execute('CREATE INDEX IF NOT EXISTS %s_name ON %s (name)' % (table, table))
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM %s' % self.table).fetchone()[0]
+
+    def __iter__(self):
+        rows = self._conn().execute('SELECT data FROM %s' % self.table).fetchall()
+        return iter([ self._factory(codec.loads(data)) for data, in rows ])
+
+    def update(self, items, changes=()):
+        """
+        replace all items, then apply any changes made while items were read,
+        as with Directory.update
+        """
+        # items may be paged in from the api as they are iterated, so are
+        # serialized first to keep the database write lock held briefly
+        rows = [ _row(x) for x in items ]
+        with self._write() as conn:
+            conn.execute('DELETE FROM %s' % self.table)
+            conn.executemany('INSERT OR REPLACE INTO %s VALUES (?, ?, ?)' % self.table, rows)
+            for op, arg in changes:
+                if op == 'upsert':
+                    conn.execute('INSERT OR REPLACE INTO %s VALUES (?, ?, ?)' % self.table,
+                                 _row(arg))
+                else:
+                    conn.execute('DELETE FROM %s WHERE id = ?' % self.table, (arg,))
+
+    def upsert(self, item):
+        """ add or replace a single item """
+        with self._write() as conn:
+            conn.execute('INSERT OR REPLACE INTO %s VALUES (?, ?, ?)' % self.table, _row(item))
+
+    def remove(self, id):
+        """ remove a single item by id, returning it if present """
+        old = self._get('id', id)
+        with self._write() as conn:
+            conn.execute('DELETE FROM %s WHERE id = ?' % self.table, (id,))
+        return old
+
+    def ids(self):
+        """ Return a read-only mapping of items by id, for reads not counted as lookups """
+        return _IdIndex(self)
+
+    def match(self, attr, val):
+        """ lookup object in directory with attribute matching value """
+        start = time.perf_counter()
+        res = self._get(attr, val)
+        self._latency.since(start)
+
+        if res is None:
+            self._misses.inc()
+        else:
+            self._hits.inc()
+        return res
+
+    def stats(self):
+        """ Return a dictionary of lookup counters and latency """
+        hits, misses = self._hits.value, self._misses.value
+        return { 'size': len(self),
+                 'hits': hits,
+                 'misses': misses,
+                 'hit_rate': hits / (hits + misses) if hits or misses else 0.0,
+                 'lookup_time': self._latency.summary() }
+
+    #######
+    # Internal Methods
+    #######
+
+    def _conn(self):
+        """ return this thread's connection, clearing its cache if the database changed """
+        loc = self._local
+        conn = getattr(loc, 'conn', None)
+        if conn is None:
+            conn = loc.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            loc.version = None
+            loc.checked = 0
+            loc.cache = {}
+            loc.generation = self._generation
+
+        if loc.generation != self._generation:
+            loc.generation = self._generation
+            loc.cache = {}
+
+        # data_version changes when another connection commits
+        now = time.monotonic()
+        if now - loc.checked >= self.check_interval:
+            loc.checked = now
+            version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if version != loc.version:
+                loc.version = version
+                loc.cache = {}
+        return conn
+
+    def _write(self):
+        """ return a connection to write with, as a transaction context """
+        return _Transaction(self, self._conn())
+
+    def _get(self, attr, val):
+        conn = self._conn()
+        cache = self._local.cache
+        key = (attr, val)
+        if key in cache:
+            return cache[key]
+
+        # first item wins on name collisions, as with Directory
+        row = conn.execute('SELECT data FROM %s WHERE %s = ? ORDER BY rowid LIMIT 1' %
+                           (self.table, 'id' if attr == 'id' else 'name'), (val,)).fetchone()
+        res = self._factory(codec.loads(row[0])) if row else None
+        cache[key] = res
+        return res
+
+def _row(item):
+    return (item.id, item.name, codec.dumps(dict(item)))
+
+class _IdIndex(object):
+    def __init__(self, directory):
+        self._dir = directory
+
+    def get(self, id, default=None):
+        res = self._dir._get('id', id)
+        return default if res is None else res
+
+class _Transaction(object):
+    """ hold the process write lock for a transaction, discarding cached reads after """
+
+    def __init__(self, directory, conn):
+        self._dir = directory
+        self._conn = conn
+
+    def __enter__(self):
+        self._dir._lock.acquire()
+        self._conn.__enter__()
+        return self._conn
+
+    def __exit__(self, *exc):
+        try:
+            return self._conn.__exit__(*exc)
+        finally:
+            self._dir._generation += 1
+            self._dir._lock.release()
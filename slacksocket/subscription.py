@@ -0,0 +1,277 @@
+import time
+import logging
+from collections import deque
+from threading import Condition, Lock
+
+import slacksocket.errors as errors
+from .config import event_types, event_priority, overflow_policies
+from .models import item_id
+
+try:
+    import queue as Queue # python3
+except ImportError:
+    import Queue # python2
+
+log = logging.getLogger('slacksocket')
+
+class Subscription(object):
+    """
+    Queue of events received by a SlackSocket, limited to the given event types
+    params:
+     - etypes(list): event types to receive. If empty, all events are received.
+     - max_queue(int): maximum number of queued events. default 0 (unbounded)
+     - overflow(str): policy applied when an event arrives for a full queue:
+        - block: wait for the consumer to make room
+        - drop_oldest: discard the oldest queued event
+        - priority: discard the oldest event of the lowest priority type
+          (user_typing, then presence updates), or the arriving event if
+          it is lower priority than any queued
+        - coalesce: replace a queued presence_change for the same user,
+          otherwise discard the oldest queued event
+    attributes:
+     - dropped(dict): number of events discarded, by reason
+    """
+
+    def __init__(self, etypes=(), max_queue=0, overflow='drop_oldest'):
+        if overflow not in overflow_policies:
+            raise errors.ConfigError('unknown overflow policy %s, expected one of %s' %
+                                     (overflow, overflow_policies))
+        self.etypes = frozenset(etypes)
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.dropped = {}
+
+        # queued [sequence, event] entries, in one deque per priority level
+        # when shedding by priority, so that overflow is handled in constant
+        # time. the oldest event is at the head of one of the deques
+        self._levels = [ deque() for _ in range(4 if overflow == 'priority' else 1) ]
+        self._size = 0
+        self._seq = 0
+        self._presence = {} # user id -> queued presence_change entry, when coalescing
+        self._lock = Lock()
+        self._not_empty = Condition(self._lock)
+        self._not_full = Condition(self._lock)
+        self._closed = False
+
+    def put(self, event):
+        with self._lock:
+            if isinstance(event, Exception):
+                # errors are always queued, and end the subscription
+                self._closed = True
+                self._not_full.notify_all()
+            elif self._closed:
+                return
+            elif self.max_queue and self._size >= self.max_queue:
+                event = self._overflow(event)
+                if event is None:
+                    return
+
+            self._append(event)
+            self._not_empty.notify()
+
+    def get_event(self, timeout=None):
+        """
+        Return a single event object or block until an event is
+        received and return it.
+         - timeout(int): Max time, in seconds, to block waiting for new event
+        """
+        with self._lock:
+            if not self._not_empty.wait_for(lambda: self._size, timeout):
+                raise Queue.Empty
+            e = self._popleft()
+            self._not_full.notify()
+
+        if isinstance(e, Exception):
+            raise e
+        return e
+
+    def get_events(self, max_n, timeout=None):
+        """
+        Return a list of up to max_n queued events, blocking until at least
+        one is received. Returns an empty list if timeout is exceeded.
+         - max_n(int): Maximum number of events to return
+         - timeout(int): Max time, in seconds, to block waiting for new events
+        """
+        with self._lock:
+            if not self._not_empty.wait_for(lambda: self._size, timeout):
+                return []
+
+            batch = []
+            while self._size and len(batch) < max_n:
+                if isinstance(self._oldest()[0][1], Exception):
+                    # return events received before an error, raising it on the next call
+                    if batch:
+                        break
+                    raise self._popleft()
+                batch.append(self._popleft())
+            self._not_full.notify(len(batch))
+
+        return batch
+
+    def events(self, idle_timeout=None):
+        """
+        returns a blocking generator yielding Slack event objects
+        params:
+         - idle_timeout(int): optional maximum amount of time (in seconds)
+           to wait between events before returning
+        """
+        while True:
+            try:
+                yield self.get_event(timeout=idle_timeout)
+            except Queue.Empty:
+                log.info('idle timeout reached for events()')
+                return
+
+    def qsize(self):
+        return self._size
+
+    def _drop(self, reason):
+        self.dropped[reason] = self.dropped.get(reason, 0) + 1
+
+    def _level(self, event):
+        """ return the index of the deque an event is queued in """
+        if len(self._levels) == 1:
+            return 0
+        if isinstance(event, Exception):
+            return 3 # never shed
+        return event_priority.get(event.type, 2)
+
+    def _append(self, event):
+        entry = [self._seq, event]
+        self._seq += 1
+        self._levels[self._level(event)].append(entry)
+        self._size += 1
+
+        if self.overflow == 'coalesce' and getattr(event, 'type', None) == 'presence_change':
+            uid = item_id(event.get('user'))
+            if uid:
+                self._presence[uid] = entry
+
+    def _oldest(self):
+        """ return the deque holding the oldest queued entry """
+        if len(self._levels) == 1:
+            return self._levels[0]
+        return min((l for l in self._levels if l), key=lambda l: l[0][0])
+
+    def _popleft(self, level=None):
+        """ remove and return the oldest queued event, or the oldest of a level """
+        entry = (self._oldest() if level is None else self._levels[level]).popleft()
+        self._size -= 1
+
+        event = entry[1]
+        if self._presence and getattr(event, 'type', None) == 'presence_change':
+            uid = item_id(event.get('user'))
+            if self._presence.get(uid) is entry:
+                del self._presence[uid]
+        return event
+
+    def _overflow(self, event):
+        """
+        make room for an event in the full queue, returning the event to
+        append, or None if it was discarded or merged into a queued event
+        """
+        if self.overflow == 'block':
+            self._not_full.wait_for(lambda: self._size < self.max_queue or self._closed)
+            return None if self._closed else event
+
+        if self.overflow == 'priority':
+            # lowest priority level with queued events, other than errors
+            lowest = next((i for i, l in enumerate(self._levels[:3]) if l), None)
+            if lowest is None or event_priority.get(event.type, 2) < lowest:
+                self._drop('shed')
+                return None
+            self._popleft(lowest)
+            self._drop('shed')
+            return event
+
+        if self.overflow == 'coalesce' and event.type == 'presence_change':
+            entry = self._presence.get(item_id(event.get('user')))
+            if entry is not None:
+                entry[1] = event
+                self._drop('coalesced')
+                return None
+
+        self._popleft()
+        self._drop('overflow')
+        return event
+
+class Dispatcher(object):
+    """
+    Routes received events to subscriptions, through a dispatch table of
+    event type -> subscriptions rebuilt whenever subscriptions change
+    params:
+     - **sub_opts: options passed to each subscription created
+    """
+    subscription = Subscription
+
+    def __init__(self, **sub_opts):
+        self._sub_opts = sub_opts
+        self._subs = []
+        self._routes = {}
+        self._catch_all = ()
+        self._subs_lock = Lock()
+        # event types processed even when no subscription receives them
+        self._tracked = frozenset()
+
+    def subscribe(self, *etypes):
+        """
+        Return a new Subscription, with its own queue, receiving events
+        of the given types as they are received
+        params:
+         - etypes(str): Slack event type(s) to receive. If none are given,
+           all events are received. See https://api.slack.com/events for
+           a listing of valid event types.
+        """
+        self._validate_etypes(*etypes)
+        sub = self.subscription(etypes, **self._sub_opts)
+        self._add_sub(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        """ Stop delivering events to a Subscription """
+        with self._subs_lock:
+            self._subs.remove(sub)
+            self._reroute()
+
+    def _wants(self, etype):
+        """ whether events of a type are processed: tracked, or received by any subscription """
+        return etype in self._tracked or bool(self._routes.get(etype, self._catch_all))
+
+    def _add_sub(self, sub):
+        with self._subs_lock:
+            self._subs.append(sub)
+            self._reroute()
+
+    def _reroute(self):
+        """ rebuild the event dispatch table from current subscriptions """
+        catch_all = tuple(s for s in self._subs if not s.etypes)
+        routes = {}
+        for sub in self._subs:
+            for etype in sub.etypes:
+                routes.setdefault(etype, catch_all)
+                routes[etype] += (sub,)
+        self._routes, self._catch_all = routes, catch_all
+
+    def _route(self, event):
+        for sub in self._routes.get(event.type, self._catch_all):
+            sub.put(event)
+
+    def _broadcast(self, item):
+        for sub in list(self._subs):
+            sub.put(item)
+
+    @staticmethod
+    def _validate_etypes(*etypes):
+        if not etypes:
+            return
+
+        invalid = [ f for f in etypes if f not in event_types ]
+        if invalid:
+            raise errors.ConfigError('unknown event type %s\n \
+                         see https://api.slack.com/events' % invalid)
+
+def remaining(deadline):
+    """ time left until a time.time() deadline, or None if no deadline """
+    if deadline is None:
+        return None
+    return max(deadline - time.time(), 0)
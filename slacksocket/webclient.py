@@ -1,55 +1,369 @@
+import gc
+import os
 import time
 import logging
 import requests
-from threading import Lock
+from threading import Lock, Thread
 
 import slacksocket.errors as errors
-from .config import urls
-from .models import User, Channel, DirItem
+from . import codec
+from .config import make_urls, page_limits
+from .metrics import Counter, Latency
+from .models import User, Channel, DirItem, CompactUser, CompactChannel
+from .retry import RequestPolicy, api_method, retry_after
+from .shared import SharedDirectory
 
 log = logging.getLogger('slacksocket')
 
-class WebClient(requests.Session):
+SNAPSHOT_VERSION = 2
+
+class DirectoryCache(object):
+    """
+    User and channel directories with a negative lookup cache, change event
+    handling and snapshots, shared by WebClient and AsyncWebClient
+    params:
+     - miss_ttl(int): time, in seconds, to remember IDs and names that were
+       not found after a directory refresh
+     - refresh_interval(int): minimum time, in seconds, between full directory
+       refreshes triggered by lookup misses
+     - snapshot_dir(str): optional directory in which to keep a per-team
+       snapshot of the user/channel directory, written after each refresh
+     - snapshot_max_age(int): maximum age, in seconds, of a snapshot to load
+     - user_fields(list): if given, store users as compact records retaining
+       only these fields (besides id and name)
+     - channel_fields(list): if given, store channels as compact records
+       retaining only these fields (besides id and name)
+     - lazy_fields(bool): fetch fields not retained in a compact record from
+       the API on first access, where supported
+     - shared_path(str): optional path of a SQLite database in which to keep
+       the directory, shared with other processes on the same machine
+     - shared_role(str): writer, to refresh the shared directory from the API,
+       or reader, to only read it. default writer
+    """
+
+    # functions returning full API data for a user or channel id, used to
+    # load fields of compact records on access
+    _load_user = None
+    _load_channel = None
+
+    def __init__(self, miss_ttl=300, refresh_interval=60,
+                 snapshot_dir=None, snapshot_max_age=86400,
+                 user_fields=None, channel_fields=None, lazy_fields=True,
+                 shared_path=None, shared_role='writer'):
+        if shared_role not in ('reader', 'writer'):
+            raise errors.ConfigError('unknown shared_role %s, expected reader or writer' %
+                                     shared_role)
+        self.shared_role = shared_role
+
+        if shared_path:
+            self._users = SharedDirectory(shared_path, 'users', self._make_user)
+            self._channels = SharedDirectory(shared_path, 'channels', self._make_channel)
+        else:
+            self._users = Directory()
+            self._channels = Directory()
+
+        # negative lookup cache and refresh tracking
+        self.miss_ttl = miss_ttl
+        self.refresh_interval = refresh_interval
+        self._misses = {}
+        self._refreshed = 0
+        self._generation = 0
+        # changes applied while a load is in progress, by item type, to be
+        # applied again to the directories it builds
+        self._changes = None
+
+        self.team_id = None
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_max_age = snapshot_max_age
+        self._snapshot_lock = Lock()
+
+        self.user_fields = user_fields
+        self.channel_fields = channel_fields
+        self.lazy_fields = lazy_fields
+
+    def load_snapshot(self):
+        """
+        Populate the directory cache from this team's snapshot file, returning
+        True if a current snapshot was found and loaded
+        """
+        path = self._snapshot_path()
+        if not path or not os.path.exists(path) or self._reader:
+            return False
+
+        try:
+            with open(path, 'rb') as f:
+                snap = codec.loads(f.read())
+        except (IOError, ValueError) as ex:
+            log.warn('unable to read directory snapshot %s: %s' % (path, ex))
+            return False
+
+        if snap.get('version') != SNAPSHOT_VERSION or snap.get('team') != self.team_id:
+            log.info('ignoring incompatible directory snapshot %s' % path)
+            return False
+        if time.time() - snap.get('created', 0) > self.snapshot_max_age:
+            log.info('ignoring expired directory snapshot %s' % path)
+            return False
+
+        users = self._from_rows(snap['users'], snap.get('user_fields'), self.user_fields,
+                                User, CompactUser, self._load_user)
+        channels = self._from_rows(snap['channels'], snap.get('channel_fields'),
+                                   self.channel_fields, Channel, CompactChannel,
+                                   self._load_channel)
+
+        # the collector would otherwise make repeated passes over the
+        # many objects created while loading
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._users.update(users)
+            self._channels.update(channels)
+        finally:
+            if enabled:
+                gc.enable()
+        log.debug('loaded directory snapshot %s' % path)
+        return True
+
+    def save_snapshot(self):
+        """
+        Write the current directory cache to this team's snapshot file, as
+        [id, name, fields] rows holding only the fields retained in memory
+        """
+        path = self._snapshot_path()
+        if not path:
+            return
+
+        snap = { 'version': SNAPSHOT_VERSION,
+                 'team': self.team_id,
+                 'created': time.time(),
+                 'user_fields': self.user_fields,
+                 'channel_fields': self.channel_fields,
+                 'users': [ _snapshot_row(x, self.user_fields) for x in self._users ],
+                 'channels': [ _snapshot_row(x, self.channel_fields) for x in self._channels ] }
+
+        # write to a temporary file and rename, so readers never see a partial snapshot
+        with self._snapshot_lock:
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp, 'w') as f:
+                f.write(codec.dumps(snap))
+            os.replace(tmp, path)
+        log.debug('saved directory snapshot %s' % path)
+
+    def apply_event(self, event):
+        """
+        Apply a directory change event received via RTM to the user and
+        channel directories in place. Ignored by shared directory readers
+        """
+        if self._reader:
+            return
+        etype = event.get('type')
+
+        if etype in ('team_join', 'user_change'):
+            self._upsert(User, self._make_user(event['user']))
+
+        elif etype in ('channel_created', 'group_joined'):
+            self._upsert(Channel, self._make_channel(event['channel']))
+
+        elif etype == 'channel_rename':
+            cdata = event['channel']
+            old = self._channels.match('id', cdata['id']) or {}
+            self._upsert(Channel, self._make_channel(dict(old, **cdata)))
+
+        elif etype == 'channel_deleted':
+            self._record(Channel, 'remove', event['channel'])
+            self._channels.remove(event['channel'])
+
+        elif etype == 'im_created':
+            # use username as name, as with im channels loaded via refresh
+            cdata = dict(event['channel'], user=event['user'])
+            cdata['name'] = self._im_name(cdata)
+            self._upsert(Channel, self._make_channel(cdata))
+
+    def stats(self):
+        """ Return lookup stats for the user and channel directories """
+        return { 'users': self._users.stats(),
+                 'channels': self._channels.stats(),
+                 'refreshes': self._generation,
+                 'negative_cached': len(self._misses) }
+
+    def add_metrics(self, registry):
+        """ Register directory lookup counters and latency with a metrics Registry """
+        for name, d in (('users', self._users), ('channels', self._channels)):
+            registry.add('directory_hits', d._hits, directory=name)
+            registry.add('directory_misses', d._misses, directory=name)
+            registry.add('directory_lookup', d._latency, directory=name)
+
+    #######
+    # Internal Methods
+    #######
+
+    @property
+    def _reader(self):
+        """ whether the directory is shared, and refreshed by another process """
+        return self.shared_role == 'reader' and isinstance(self._users, SharedDirectory)
+
+    def _dir(self, stype):
+        return self._users if stype == User else self._channels
+
+    @staticmethod
+    def _user_key(match):
+        """ directory attribute to look up a user match by """
+        return 'id' if len(match) == 9 and match[0] == 'U' else 'name'
+
+    @staticmethod
+    def _channel_key(match):
+        """ directory attribute to look up a channel match by """
+        return 'id' if len(match) == 9 and match[0] in ('C','G','D') else 'name'
+
+    def _missed(self, key):
+        """ whether a lookup is in the negative cache """
+        return self._misses.get(key, 0) > time.time()
+
+    def _miss(self, key):
+        log.debug('caching directory miss for %s %s' % key[1:])
+        self._misses[key] = time.time() + self.miss_ttl
+
+    def _loaded(self):
+        """ record completion of a full directory load """
+        self._misses = {}
+        self._refreshed = time.time()
+        self._generation += 1
+
+    def _from_rows(self, rows, saved_fields, fields, full, compact, loader):
+        """ yield directory items from snapshot rows saved with the given fields """
+        if fields is None:
+            for id, name, data in rows:
+                yield full(dict(data, id=id, name=name))
+        elif saved_fields is not None and list(saved_fields) == list(fields):
+            # rows hold exactly the fields retained
+            loader = loader if self.lazy_fields else None
+            for id, name, data in rows:
+                yield compact.from_row(id, name, data, loader)
+        else:
+            for id, name, data in rows:
+                yield compact(dict(data, id=id, name=name), fields,
+                              loader if self.lazy_fields else None)
+
+    def _save_snapshot(self):
+        """ write a snapshot after a refresh, outside the refresh lock """
+        if not self.snapshot_dir or self._reader:
+            return
+        try:
+            self.save_snapshot()
+        except (IOError, OSError) as ex:
+            log.warn('unable to write directory snapshot: %s' % ex)
+
+    def _im_name(self, cdata, users=None):
+        """ name an im channel after its user, found through a users id index """
+        if users is None:
+            users = self._users.ids()
+        user = users.get(cdata['user'])
+        return user.name if user else cdata['user']
+
+    def _channel_items(self, page, ims):
+        """
+        yield items for a page of channels, holding back im channels in ims
+        to be named by _im_items once users are loaded
+        """
+        for cdata in page['channels']:
+            if cdata['id'][0] == 'D':
+                ims.append(cdata)
+            else:
+                yield self._make_channel(cdata)
+
+    def _im_items(self, ims):
+        """ yield items for held im channels, using username as name """
+        users = self._users.ids()
+        for cdata in ims:
+            cdata['name'] = self._im_name(cdata, users)
+            yield self._make_channel(cdata)
+
+    def _snapshot_path(self):
+        if not self.snapshot_dir or not self.team_id:
+            return None
+        return os.path.join(self.snapshot_dir, 'slacksocket-%s.json' % self.team_id)
+
+    def _make_user(self, data):
+        if self.user_fields is None:
+            return User(data)
+        loader = self._load_user if self.lazy_fields else None
+        return CompactUser(data, self.user_fields, loader)
+
+    def _make_channel(self, data):
+        if self.channel_fields is None:
+            return Channel(data)
+        loader = self._load_channel if self.lazy_fields else None
+        return CompactChannel(data, self.channel_fields, loader)
+
+    def _record(self, stype, op, arg):
+        """
+        record a change for a load in progress. changes are recorded before
+        they are made, so each either reaches the directory being replaced
+        after it is recorded, or the new directory
+        """
+        changes = self._changes
+        if changes is not None:
+            changes[stype].append((op, arg))
+
+    def _upsert(self, stype, item):
+        log.debug('updating directory entry for %s' % item.id)
+        self._record(stype, 'upsert', item)
+        self._dir(stype).upsert(item)
+        self._misses.pop((stype, 'id', item.id), None)
+        self._misses.pop((stype, 'name', item.name), None)
+
+class WebClient(DirectoryCache, requests.Session):
     """
     Minimal client for connecting to Slack web API and translating user/channel
     IDs to human-readable names
+    params:
+     - token(str): token to authenticate with slack
+     - timeout(int): maximum amount of time to retry a failing API call
+     - request_timeout(float): maximum time to wait for a response to a
+       single API request. default 5
+     - api_url(str): base url of the Slack web API. default https://slack.com/api/
+     - policy(RequestPolicy): retry and rate limit policy for API requests,
+       which may be shared between clients. default RequestPolicy()
+     - **opts: directory options, see DirectoryCache
     """
 
-    def __init__(self, token, timeout):
+    def __init__(self, token, timeout, request_timeout=5, policy=None,
+                 api_url=None, **opts):
         self._token = token
+        self._urls = make_urls(api_url)
         self._timeout = timeout
-        self._users = Directory()
-        self._channels = Directory()
+        self.request_timeout = request_timeout
+        self.policy = policy or RequestPolicy()
         self._lock = Lock()
-        super(WebClient, self).__init__()
+        DirectoryCache.__init__(self, **opts)
+        requests.Session.__init__(self)
 
     def login(self):
         """ perform API auth test returning user and team """
         log.debug('performing auth test')
-        test = self._get(urls['test'])
+        test = self._get(self._urls['test'])
         user = User({ 'name': test['user'], 'id': test['user_id'] })
-        self._refresh()
+        self.team_id = test.get('team_id')
         return test['team'], user
 
+    def preload(self):
+        """ load the user/channel directory cache, if not already loaded """
+        self._refresh_once()
+
     def rtm_url(self):
         """ Retrieve a fresh websocket url from slack api """
-        return self._get(urls['rtm'])['url']
+        return self._get(self._urls['rtm'])['url']
 
     def open_im(self, user_id):
-        res = self._post(urls['im.open'], user=user_id)
+        res = self._post(self._urls['im.open'], user=user_id)
         return Channel({'name':user_id, 'id': res['channel']})
 
     def user(self, match):
         """ Return User object for a given Slack ID or name """
-        if len(match) == 9 and match[0] == 'U':
-            return self._lookup(User, 'id', match)
-        return self._lookup(User, 'name', match)
+        return self._lookup(User, self._user_key(match), match)
 
     def channel(self, match):
         """ Return Channel object for a given Slack ID or name """
-        if len(match) == 9 and match[0] in ('C','G','D'):
-            return self._lookup(Channel, 'id', match)
-        return self._lookup(Channel, 'name', match)
+        return self._lookup(Channel, self._channel_key(match), match)
 
     #######
     # Internal Methods
@@ -62,29 +376,42 @@ class WebClient(requests.Session):
         return self._do('POST', url, **params)
 
     def _do(self, method, url, **params):
-        start = time.time()
+        deadline = time.monotonic() + self._timeout if self._timeout > 0 else None
+        api = api_method(url)
         params['token'] = self._token
+        attempt = 0
 
         while True:
-            if self._timeout > 0 and time.time() - start >= self._timeout:
-                raise errors.TimeoutError('connection timeout exceeded')
+            time.sleep(self.policy.wait_time(api, time.monotonic(), self._token))
+            attempt += 1
             try:
                 return self._do_once(method, url, **params)
-            except errors.APIError as ex:
-                raise ex
             except Exception as ex:
-                log.error(ex)
-                time.sleep(2)
+                delay = self.policy.retry_time(api, attempt, ex, time.monotonic(),
+                                              self._token)
+                if delay is None:
+                    raise
+                log.error('%s failed, retrying in %.1fs: %s' % (api, delay, ex))
+
+            if deadline and time.monotonic() + delay >= deadline:
+                raise errors.TimeoutError('connection timeout exceeded')
+            time.sleep(delay)
 
     def _do_once(self, method, url, **params):
-        res = self.request(method, url, params=params, timeout=5)
+        res = self.request(method, url, params=params, timeout=self.request_timeout)
 
+        if res.status_code == 429:
+            raise errors.RateLimitError('rate limited by slack api',
+                                        retry_after(res.headers.get('Retry-After')))
+        if res.status_code >= 500:
+            # server errors are retried
+            raise IOError('%d error from slack api: %s' % (res.status_code, res.reason))
         try:
             res.raise_for_status()
         except requests.exceptions.HTTPError as e:
             raise errors.APIError(e)
 
-        rj = res.json()
+        rj = codec.loads(res.content)
 
         if rj['ok']:
             return rj
@@ -97,6 +424,7 @@ class WebClient(requests.Session):
 
     def _get_pages(self, url, **params):
         params['cursor'] = ''
+        params.setdefault('limit', 200)
 
         while True:
             res = self._get(url, **params)
@@ -107,57 +435,193 @@ class WebClient(requests.Session):
                 return
 
     def _lookup(self, stype, attr, val):
-        if stype == User:
-            sdir = self._users
-        if stype == Channel:
-            sdir = self._channels
+        sdir = self._dir(stype)
+        res = sdir.match(attr, val)
+        if res:
+            return res
+
+        key = (stype, attr, val)
+        if self._missed(key):
+            return DirItem({})
 
+        # reload cache and try again
+        self._refresh_once()
         res = sdir.match(attr, val)
         if not res:
-            # reload cache and try again
-            self._refresh()
-            res = sdir.match(attr, val)
-        return res if res else DirItem({})
+            self._miss(key)
+            return DirItem({})
+        return res
+
+    def _load_user(self, user_id):
+        return self._get(self._urls['users.info'], user=user_id)['user']
+
+    def _load_channel(self, channel_id):
+        return self._get(self._urls['convos.info'], channel=channel_id)['channel']
+
+    def _refresh_once(self):
+        """
+        refresh internal directory cache on behalf of a lookup miss. concurrent
+        callers share a single in-progress refresh, and no refresh is made if
+        the last one completed less than refresh_interval seconds ago
+        """
+        generation = self._generation
+        with self._lock:
+            if generation != self._generation:
+                return # refreshed by another caller while we waited
+            if time.time() - self._refreshed < self.refresh_interval:
+                return
+            self._load()
+        self._save_snapshot()
 
     def _refresh(self):
         """ refresh internal directory cache """
+        with self._lock:
+            self._load()
+        self._save_snapshot()
+
+    def _load(self):
+        """
+        page through users and channels concurrently, each streamed into a
+        new index which is swapped in once complete
+        """
+        if self._reader:
+            return
         log.debug('refreshing directory cache')
-        self._users.update(list(self._user_gen()))
-        self._channels.update(list(self._channel_gen()))
+        failed = []
+        changes = self._changes = { User: [], Channel: [] }
+
+        def load_users():
+            try:
+                self._users.update(self._user_gen(), changes[User])
+            except Exception as ex:
+                failed.append(ex)
+
+        users = Thread(target=load_users)
+        users.daemon = True
+        users.start()
+        try:
+            self._channels.update(self._channel_gen(users, failed), changes[Channel])
+        finally:
+            users.join()
+            self._changes = None
+
+        if failed:
+            raise failed[0]
+        self._loaded()
 
     def _user_gen(self):
-        for page in self._get_pages(urls['users']):
+        for page in self._get_pages(self._urls['users'], limit=page_limits['users']):
             for data in page['members']:
-                yield User(data)
+                yield self._make_user(data)
 
-    def _channel_gen(self):
-        pages = self._get_pages(urls['convos'],
+    def _channel_gen(self, users, failed):
+        """ yield channels, then im channels once the users thread completes """
+        pages = self._get_pages(self._urls['convos'], limit=page_limits['convos'],
                 types='public_channel,private_channel,mpim,im')
 
+        ims = []
         for page in pages:
-            for cdata in page['channels']:
-                # if im channel, use username as name
-                if cdata['id'][0] == 'D':
-                    cdata['name'] = self._users.match('id', cdata['user']).name
-                yield Channel(cdata)
-
-class Directory(list):
-    """ Generic locking store """
+            for channel in self._channel_items(page, ims):
+                yield channel
+
+        users.join()
+        if failed:
+            raise failed[0]
+        for channel in self._im_items(ims):
+            yield channel
+
+def _snapshot_row(item, fields):
+    """ [id, name, fields] snapshot row of an item, holding the given fields or all others """
+    if fields is None:
+        data = { k: v for k, v in item.items() if k not in ('id', 'name') }
+    else:
+        held = item.keys() # don't load fields a compact item doesn't hold
+        data = { k: item[k] for k in fields if k in held }
+    return [ item.id, item.name, data ]
+
+class Directory(object):
+    """
+    Indexed store of directory items. Lookups by id or name are served
+    from hash indexes which are rebuilt and swapped in whole on update,
+    so readers never wait on a refresh in progress.
+    """
+
     def __init__(self):
-        self._lock = Lock()
+        self._index = { 'id': {}, 'name': {} }
+        self._lock = Lock() # serializes writers only
+        self._hits = Counter()
+        self._misses = Counter()
+        self._latency = Latency()
+
+    def __len__(self):
+        return len(self._index['id'])
 
-    def update(self, items):
-        self._lock.acquire()
-        self.clear()
-        self += items
-        self._lock.release()
+    def __iter__(self):
+        return iter(list(self._index['id'].values()))
+
+    def update(self, items, changes=()):
+        """
+        replace all items. changes is a list of ('upsert', item) and ('remove', id)
+        changes made while items were read, applied before the new index is swapped in
+        """
+        ids, names = {}, {}
+        for x in items:
+            ids[x.id] = x
+            # first item wins on name collisions, as with a linear scan
+            names.setdefault(x.name, x)
+
+        with self._lock:
+            for op, arg in changes:
+                if op == 'upsert':
+                    _put(ids, names, arg)
+                else:
+                    _pop(ids, names, arg)
+            self._index = { 'id': ids, 'name': names }
+
+    def upsert(self, item):
+        """ add or replace a single item in place """
+        with self._lock:
+            _put(self._index['id'], self._index['name'], item)
+
+    def remove(self, id):
+        """ remove a single item by id, returning it if present """
+        with self._lock:
+            return _pop(self._index['id'], self._index['name'], id)
+
+    def ids(self):
+        """ Return the current id index, for bulk reads not counted as lookups """
+        return self._index['id']
 
     def match(self, attr, val):
         """ lookup object in directory with attribute matching value """
-        self._lock.acquire()
-        try:
-            for x in self:
-                if getattr(x, attr) == val:
-                    return x
-        finally:
-            self._lock.release()
+        start = time.perf_counter()
+        res = self._index[attr].get(val)
+        self._latency.since(start)
+
+        if res is None:
+            self._misses.inc()
+        else:
+            self._hits.inc()
+        return res
+
+    def stats(self):
+        """ Return a dictionary of lookup counters and latency """
+        hits, misses = self._hits.value, self._misses.value
+        return { 'size': len(self),
+                 'hits': hits,
+                 'misses': misses,
+                 'hit_rate': hits / (hits + misses) if hits or misses else 0.0,
+                 'lookup_time': self._latency.summary() }
+
+def _put(ids, names, item):
+    old = ids.get(item.id)
+    if old is not None and names.get(old.name) is old:
+        del names[old.name]
+    ids[item.id] = item
+    names[item.name] = item
+
+def _pop(ids, names, id):
+    old = ids.pop(id, None)
+    if old is not None and names.get(old.name) is old:
+        del names[old.name]
+    return old
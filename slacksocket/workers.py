@@ -0,0 +1,60 @@
+import logging
+from threading import Thread
+
+try:
+    import queue as Queue # python3
+except ImportError:
+    import Queue # python2
+
+log = logging.getLogger('slacksocket')
+
+class WorkerPool(object):
+    """
+    Pool of threads applying a function to submitted items. Each item is
+    assigned to a worker by key, so items sharing a key are processed one at
+    a time in the order submitted.
+    params:
+     - func(callable): function to apply to each item
+     - size(int): number of worker threads
+     - max_queue(int): maximum items waiting per worker, beyond which
+       submit() blocks. default 0 (unbounded)
+    """
+
+    def __init__(self, func, size=1, max_queue=0):
+        self._func = func
+        self._queues = [ Queue.Queue(max_queue) for _ in range(max(size, 1)) ]
+
+        for q in self._queues:
+            t = Thread(target=self._work, args=(q,))
+            t.daemon = True
+            t.start()
+
+    def submit(self, key, item):
+        self._queues[hash(key) % len(self._queues)].put(item)
+
+    def depth(self):
+        """ Return the number of items waiting to be processed """
+        return sum(q.qsize() for q in self._queues)
+
+    def join(self):
+        """ Block until all items submitted have been processed """
+        for q in self._queues:
+            q.join()
+
+    def stop(self):
+        """ Stop all workers once items already submitted are processed """
+        for q in self._queues:
+            q.put(None)
+
+    def _work(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                return
+            try:
+                self._func(item)
+            except Exception as ex:
+                log.exception('error processing %s: %s' % (item, ex))
+            finally:
+                q.task_done()
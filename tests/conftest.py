@@ -0,0 +1,31 @@
+import threading
+
+import pytest
+
+from slacksocket import SlackSocket
+from slacksocket.fakeslack import FakeSlack
+from slacksocket.retry import RequestPolicy
+
+# websocket-client 0.56 calls Thread.isAlive, removed in python 3.9
+if not hasattr(threading.Thread, 'isAlive'):
+    threading.Thread.isAlive = threading.Thread.is_alive
+
+@pytest.fixture
+def fake():
+    with FakeSlack(users=10, channels=5) as fake:
+        yield fake
+
+@pytest.fixture
+def connect(fake):
+    """ return a function connecting SlackSockets to the fake server, closed after the test """
+    sockets = []
+    def connect(**opts):
+        s = SlackSocket('xoxb-test', api_url=fake.api_url, handle_signals=False,
+                        policy=RequestPolicy(rate_limit=False), **opts)
+        sockets.append(s)
+        s.wait_for_directory(timeout=5)
+        fake.wait_clients(timeout=5)
+        return s
+    yield connect
+    for s in sockets:
+        s.close()
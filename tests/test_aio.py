@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from slacksocket.aio import AsyncSlackSocket
+from slacksocket.models import SlackMsg
+from slacksocket.retry import RequestPolicy
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+def connect(fake, **opts):
+    return AsyncSlackSocket('xoxb-test', api_url=fake.api_url,
+                            policy=RequestPolicy(rate_limit=False), **opts).connect()
+
+def test_receive_and_send(fake):
+    async def main():
+        s = await connect(fake)
+        try:
+            await s.wait_for_directory(timeout=5)
+            fake.send({ 'type': 'message', 'channel': 'C00000001',
+                        'user': 'U00000001', 'text': 'hi' })
+            event = await s.get_event('message', timeout=5)
+            assert event.user.name == 'user1'
+
+            msg = await s.send_msg('hi', event.channel, timeout=5)
+            assert msg.sent
+        finally:
+            await s.close()
+    run(main())
+
+def test_send_held_while_disconnected(fake):
+    async def main():
+        s = await connect(fake)
+        try:
+            channel = await s.lookup_channel('channel1')
+            # slow rtm.connect, to send while reconnecting
+            fake.latency = .2
+            fake.disconnect()
+            while s._connected.is_set():
+                await asyncio.sleep(.01)
+
+            msg = await s.send_msg('hi', channel, timeout=5)
+            assert msg.sent
+            assert fake.calls['rtm.connect'] == 2
+        finally:
+            await s.close()
+    run(main())
+
+def test_resend_skips_sends_removed_meanwhile():
+    class StubWS(object):
+        def __init__(self):
+            self.sent = []
+
+        async def send_str(self, data):
+            self.sent.append(data)
+            # the other pending send times out while this one is written
+            s._unacked.pop(2, None)
+            await asyncio.sleep(0)
+
+    s = AsyncSlackSocket.__new__(AsyncSlackSocket)
+    s._send_id = 2
+    s.ws = StubWS()
+
+    async def main():
+        loop = asyncio.get_event_loop()
+        s._unacked = { i: (SlackMsg(i, 'C00000001', 'hi'), loop.create_future(), 0)
+                       for i in (1, 2) }
+        await s._resend()
+
+    run(main())
+    assert len(s.ws.sent) == 1
+    assert list(s._unacked) == [3]
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import slacksocket.errors as errors
+from slacksocket.client import STATE_CONNECTED
+
+def message(n=0, **fields):
+    return dict({ 'type': 'message', 'channel': 'C00000001', 'user': 'U00000001',
+                  'text': 'hi %d' % n }, **fields)
+
+def test_events_in_order(fake, connect):
+    s = connect(workers=4)
+    fake.replay([ message(n) for n in range(100) ])
+    events = []
+    while len(events) < 100:
+        events.extend(s.get_events('message', timeout=5))
+    assert [ e['text'] for e in events ] == [ 'hi %d' % n for n in range(100) ]
+
+def test_subscription_only(fake, connect):
+    s = connect(catch_all=False)
+    sub = s.subscribe('message')
+    fake.send({ 'type': 'user_typing', 'channel': 'C00000001', 'user': 'U00000001' })
+    fake.send(message())
+    assert sub.get_event(timeout=5)['text'] == 'hi 0'
+    with pytest.raises(errors.ConfigError):
+        s.get_event()
+
+def test_track_changes_without_subscriber(fake, connect):
+    s = connect(catch_all=False, track_changes=True)
+    sub = s.subscribe('message')
+    fake.send({ 'type': 'team_join', 'user': { 'id': 'U00000900', 'name': 'new' } })
+    fake.send(message(user='U00000900'))
+    assert sub.get_event(timeout=5).user.name == 'new'
+    assert fake.calls['users.list'] == 1
+
+def test_reconnect_emits_gap(fake, connect):
+    s = connect()
+    gaps = s.subscribe('connection_gap')
+    fake.disconnect()
+
+    gap = gaps.get_event(timeout=5)
+    assert gap['reconnected'] >= gap['disconnected']
+    assert s.wait_for_state(STATE_CONNECTED, timeout=5)
+    assert s.stats()['reconnects'] == 1
+    assert fake.calls['rtm.connect'] == 2
+
+    fake.wait_clients(timeout=5)
+    fake.send(message())
+    assert s.get_event('message', timeout=5)
+
+def test_send_held_while_disconnected(fake, connect):
+    s = connect()
+    channel = s.lookup_channel('channel1')
+    # slow rtm.connect, to send while reconnecting
+    fake.latency = .2
+    fake.disconnect()
+    time.sleep(.05)
+
+    future = s.submit_msg('hi', channel, timeout=5)
+    assert future.result(5).sent
+    assert fake.calls['rtm.connect'] == 2
+
+def test_merged_sends(fake, connect):
+    s = connect(merge_sends=True, send_rate=1, send_burst=1)
+    channel = s.lookup_channel('channel1')
+    first = s.send_msg('first', channel, timeout=5)
+
+    # queued behind the first send's rate limit, then sent as one
+    futures = [ s.submit_msg('line %d' % n, channel, timeout=5) for n in range(3) ]
+    msgs = [ f.result(5) for f in futures ]
+    assert all(m is msgs[0] for m in msgs)
+    assert msgs[0].payload['text'] == 'line 0\nline 1\nline 2'
+    assert msgs[0].id == first.id + 1
+
+def test_close_fails_pending(fake, connect):
+    s = connect()
+    fake.latency = .2
+    fake.disconnect()
+    time.sleep(.05)
+    future = s.submit_msg('hi', s.lookup_channel('channel1'))
+    s.close()
+    with pytest.raises(errors.ExitError):
+        future.result(5)
+    with pytest.raises(errors.ExitError):
+        while True: # events received before closing are delivered first
+            s.get_event(timeout=5)
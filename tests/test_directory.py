@@ -0,0 +1,81 @@
+import time
+import threading
+
+import pytest
+
+from slacksocket.fakeslack import FakeSlack, make_channel, make_user
+from slacksocket.models import User, Channel
+from slacksocket.retry import RequestPolicy
+from slacksocket.webclient import Directory, WebClient
+
+def changes(client):
+    """ apply directory change events, as received during a refresh """
+    client.apply_event({ 'type': 'team_join', 'user': make_user(900) })
+    client.apply_event({ 'type': 'channel_created', 'channel': make_channel(900) })
+    client.apply_event({ 'type': 'channel_deleted', 'channel': 'C00000001' })
+
+@pytest.fixture
+def fake():
+    # slow pages, so that a refresh is in progress for a while
+    with FakeSlack(users=40, channels=40, page_size=10, latency=.05) as fake:
+        yield fake
+
+def client(fake, **opts):
+    return WebClient('xoxb-test', 0, api_url=fake.api_url,
+                     policy=RequestPolicy(rate_limit=False), **opts)
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_changes_during_refresh_kept(fake, tmpdir, shared):
+    opts = { 'shared_path': str(tmpdir.join('dir.db')) } if shared else {}
+    c = client(fake, **opts)
+    c._refresh()
+
+    t = threading.Thread(target=c._refresh)
+    t.start()
+    time.sleep(.1)
+    changes(c)
+    t.join()
+
+    assert c.user('user900').id == 'U00000900'
+    assert c.channel('channel900').id == 'C00000900'
+    assert not c.channel('C00000001')
+    assert fake.calls['users.list'] == 8 # no refresh on lookup
+
+def test_directory_update_applies_changes():
+    d = Directory()
+    d.update([ User({ 'id': 'U1', 'name': 'a' }), User({ 'id': 'U2', 'name': 'b' }) ])
+
+    changes = []
+    def items():
+        yield User({ 'id': 'U1', 'name': 'a' })
+        changes.append(('upsert', User({ 'id': 'U3', 'name': 'c' })))
+        changes.append(('remove', 'U1'))
+        yield User({ 'id': 'U2', 'name': 'b' })
+
+    d.update(items(), changes)
+    assert d.match('name', 'c').id == 'U3'
+    assert d.match('id', 'U1') is None
+    assert d.match('name', 'b').id == 'U2'
+    assert len(d) == 2
+
+def test_async_changes_during_refresh_kept(fake):
+    pytest.importorskip('aiohttp')
+    import asyncio
+    from slacksocket.aio import AsyncWebClient
+
+    async def main():
+        c = AsyncWebClient('xoxb-test', api_url=fake.api_url,
+                           policy=RequestPolicy(rate_limit=False))
+        try:
+            refresh = asyncio.ensure_future(c._load())
+            await asyncio.sleep(.1)
+            changes(c)
+            await refresh
+
+            assert (await c.user('user900')).id == 'U00000900'
+            assert (await c.channel('channel900')).id == 'C00000900'
+            assert not await c.channel('C00000001')
+        finally:
+            await c.close()
+
+    asyncio.run(main())
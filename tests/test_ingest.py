@@ -0,0 +1,55 @@
+import json
+import time
+
+from slacksocket.ingest import Coalescer
+
+def frame(etype, **fields):
+    return json.dumps(dict({ 'type': etype }, **fields))
+
+def coalescer(**windows):
+    emitted = []
+    return Coalescer(windows, emitted.append), emitted
+
+def test_collapses_within_window():
+    c, emitted = coalescer(presence_change=.1)
+    assert c.hold('presence_change', frame('presence_change', user='U1', presence='away'))
+    assert c.hold('presence_change', frame('presence_change', user='U1', presence='active'))
+    assert c.hold('presence_change', frame('presence_change', user='U2', presence='away'))
+    assert not c.hold('message', frame('message', user='U1'))
+    assert emitted == []
+
+    time.sleep(.3)
+    assert [ json.loads(f)['user'] for f in emitted ] == ['U1', 'U2']
+    assert json.loads(emitted[0])['presence'] == 'active'
+    assert c.suppressed['presence_change'].value == 1
+    c.stop()
+
+def test_pref_change_keyed_by_name():
+    c, emitted = coalescer(pref_change=5)
+    c.hold('pref_change', frame('pref_change', name='theme', value='dark'))
+    c.hold('pref_change', frame('pref_change', name='emoji_mode', value='default'))
+    c.hold('pref_change', frame('pref_change', name='theme', value='light'))
+    c.flush()
+
+    assert [ json.loads(f)['value'] for f in emitted ] == ['light', 'default']
+    assert c.suppressed['pref_change'].value == 1
+    c.stop()
+
+def test_batched_presence_keyed_by_users():
+    c, emitted = coalescer(presence_change=5)
+    c.hold('presence_change', frame('presence_change', users=['U1', 'U2'], presence='away'))
+    c.hold('presence_change', frame('presence_change', users=['U3'], presence='away'))
+    c.hold('presence_change', frame('presence_change', users=['U2', 'U1'], presence='active'))
+    c.flush()
+
+    assert [ json.loads(f)['presence'] for f in emitted ] == ['active', 'away']
+    assert c.suppressed['presence_change'].value == 1
+    c.stop()
+
+def test_stop_discards_held():
+    c, emitted = coalescer(user_typing=.05)
+    c.hold('user_typing', frame('user_typing', user='U1', channel='C1'))
+    c.stop()
+    time.sleep(.1)
+    assert emitted == []
+    assert c.depth() == 0
@@ -0,0 +1,47 @@
+import time
+import threading
+
+from slacksocket.models import CompactUser, peek_ids, peek_type
+
+def test_compact_fields():
+    u = CompactUser({ 'id': 'U1', 'name': 'a', 'tz': 'UTC', 'deleted': False }, ['tz'])
+    assert u['tz'] == 'UTC'
+    assert u.get('deleted') is None
+    assert u.keys() == ['id', 'name', 'tz']
+
+def test_compact_loads_once_across_threads():
+    calls = []
+    def loader(id):
+        calls.append(id)
+        time.sleep(.1)
+        return { 'id': id, 'name': 'a', 'real_name': 'A' }
+
+    u = CompactUser({ 'id': 'U1', 'name': 'a' }, ['tz'], loader)
+    results = []
+    threads = [ threading.Thread(target=lambda: results.append(u.get('real_name')))
+                for _ in range(8) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == ['U1']
+    assert results == ['A'] * 8
+
+def test_compact_failed_load_treated_as_missing():
+    calls = []
+    def loader(id):
+        calls.append(id)
+        raise IOError('unavailable')
+
+    u = CompactUser({ 'id': 'U1', 'name': 'a', 'tz': 'UTC' }, ['tz'], loader)
+    assert u.get('real_name') is None
+    assert u.get('real_name') is None
+    assert u['tz'] == 'UTC'
+    assert calls == ['U1']
+
+def test_peek():
+    frame = '{"type": "message", "channel": "C1", "user": "U1", "text": "hi"}'
+    assert peek_type(frame) == 'message'
+    assert peek_ids(frame) == ('U1', 'C1')
+    assert peek_type('{"reply_to": 1}') is None
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+import slacksocket.errors as errors
+from slacksocket import SlackSocket
+from slacksocket.fakeslack import FakeSlack
+from slacksocket.recording import Recorder, Replay
+from slacksocket.retry import RequestPolicy
+
+def test_round_trip(tmpdir):
+    path = str(tmpdir.join('rtm.rec'))
+    r = Recorder(path)
+    r.record('{"type": "hello"}', ts=1.0)
+    r.record('{"type": "message", "text": "\\u2603"}', ts=2.0)
+    r.close()
+
+    # appending keeps earlier frames
+    r = Recorder(path)
+    r.record('{"type": "goodbye"}', ts=3.0)
+    r.close()
+
+    frames = list(Replay(path))
+    assert [ ts for ts, _ in frames ] == [1.0, 2.0, 3.0]
+    assert json.loads(frames[1][1])['text'] == '☃'
+
+def test_partial_frame_ignored(tmpdir):
+    path = str(tmpdir.join('rtm.rec'))
+    r = Recorder(path)
+    r.record('{"type": "hello"}')
+    r.close()
+    with open(path, 'ab') as f:
+        f.write(b'\x00' * 6)
+    assert len(list(Replay(path))) == 1
+
+def test_not_a_recording(tmpdir):
+    path = tmpdir.join('other')
+    path.write('nope')
+    with pytest.raises(errors.ConfigError):
+        Replay(str(path))
+
+def test_record(tmpdir):
+    path = str(tmpdir.join('rtm.rec'))
+    with FakeSlack(users=10, channels=5) as fake:
+        s = SlackSocket('xoxb-test', record=path, api_url=fake.api_url, handle_signals=False,
+                        policy=RequestPolicy(rate_limit=False))
+        s.wait_for_directory(timeout=5)
+        fake.wait_clients(timeout=5)
+        fake.send({ 'type': 'message', 'channel': 'C00000001', 'text': 'hi' })
+        assert s.get_event('message', timeout=5)['text'] == 'hi'
+        s.close()
+
+    frames = [ json.loads(f) for _, f in Replay(path) ]
+    assert frames[-1]['text'] == 'hi'
+
+def test_replay(tmpdir):
+    path = str(tmpdir.join('rtm.rec'))
+    r = Recorder(path)
+    r.record('{"type": "hello"}', ts=0)
+    r.record(json.dumps({ 'type': 'message', 'channel': 'C00000001',
+                          'user': 'U00000001', 'text': 'hi' }), ts=.5)
+    r.close()
+
+    with FakeSlack(users=10, channels=5) as fake:
+        s = SlackSocket('xoxb-test', replay=Replay(path, speed=1), api_url=fake.api_url,
+                        handle_signals=False, policy=RequestPolicy(rate_limit=False))
+        # sends are acknowledged without being sent
+        assert s.send_msg('hi', s.lookup_channel('channel1'), timeout=5).sent
+        assert s.get_event('hello', timeout=5)
+        assert s.get_event('message', timeout=5).user.name == 'user1'
+        with pytest.raises(errors.ExitError):
+            s.get_event(timeout=5)
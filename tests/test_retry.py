@@ -0,0 +1,39 @@
+import slacksocket.errors as errors
+from slacksocket.retry import RequestPolicy, retry_after
+
+def test_paces_within_tier():
+    policy = RequestPolicy()
+    # rtm.connect allows a burst of 3, then one per minute
+    delays = [ policy.wait_time('rtm.connect', 0, 'xoxb-a') for _ in range(4) ]
+    assert delays[:3] == [0, 0, 0]
+    assert delays[3] > 0
+    assert policy.throttled.value == 1
+
+def test_paces_per_token():
+    policy = RequestPolicy()
+    delays = [ policy.wait_time('rtm.connect', 0, 'xoxb-%d' % n) for n in range(100) ]
+    assert delays == [0] * 100
+
+def test_paged_methods_not_paced():
+    policy = RequestPolicy()
+    delays = [ policy.wait_time('users.list', 0, 'xoxb-a') for _ in range(100) ]
+    assert delays == [0] * 100
+
+def test_rate_limited_holds_method():
+    policy = RequestPolicy()
+    err = errors.RateLimitError('rate limited', 30)
+    assert policy.retry_time('users.list', 1, err, 0, 'xoxb-a') == 30
+    assert 29 < policy.wait_time('users.list', 0, 'xoxb-a') <= 30
+    assert policy.wait_time('users.list', 0, 'xoxb-b') == 0
+
+def test_api_errors_not_retried():
+    policy = RequestPolicy()
+    assert policy.retry_time('auth.test', 1, errors.APIError('invalid_auth'), 0) is None
+
+def test_backoff():
+    policy = RequestPolicy(backoff=1, max_backoff=4, jitter=False)
+    assert [ policy.backoff_time(n) for n in range(1, 5) ] == [1, 2, 4, 4]
+
+def test_retry_after():
+    assert retry_after('2') == 2
+    assert retry_after(None) is None
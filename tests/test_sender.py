@@ -0,0 +1,77 @@
+import time
+from threading import Event
+
+from slacksocket.sender import Sender, TokenBucket
+
+def test_token_bucket():
+    b = TokenBucket(rate=2, burst=2)
+    now = b.stamp
+    for _ in range(2):
+        assert b.delay(now) == 0
+        b.take()
+    assert b.delay(now) == .5
+    assert b.delay(now + .5) == 0
+
+def collect(n, **opts):
+    """ run a sender until n writes are made, returning them with their times """
+    writes = []
+    done = Event()
+    def write(items):
+        writes.append((time.monotonic(), items))
+        if len(writes) == n:
+            done.set()
+    return Sender(write, **opts), writes, done
+
+def test_paused_until_resumed():
+    s, writes, done = collect(1)
+    s.put('C1', 'a')
+    time.sleep(.05)
+    assert writes == []
+    s.resume()
+    assert done.wait(1)
+    assert writes[0][1] == ['a']
+    s.stop()
+
+def test_rate_limited_per_channel():
+    s, writes, done = collect(5, rate=20, burst=2)
+    for item in 'abc':
+        s.put('C1', item)
+    for item in 'de':
+        s.put('C2', item)
+    start = time.monotonic()
+    s.resume()
+    assert done.wait(2)
+    s.stop()
+
+    by_channel = {}
+    for ts, items in writes:
+        by_channel.setdefault(items[0] in 'abc', []).append((ts, items[0]))
+    assert [ i for _, i in by_channel[True] ] == ['a', 'b', 'c']
+    assert [ i for _, i in by_channel[False] ] == ['d', 'e']
+    # the third write to C1 waits for a token, the others don't
+    assert by_channel[True][2][0] - start >= .04
+    assert by_channel[False][1][0] - start < .04
+
+def test_merge():
+    s, writes, done = collect(1, merge=True)
+    for item in 'abc':
+        s.put('C1', item)
+    s.resume()
+    assert done.wait(1)
+    assert writes[0][1] == ['a', 'b', 'c']
+    s.stop()
+
+def test_requeue_at_front():
+    s, writes, done = collect(2)
+    s.put('C1', 'b')
+    s.put('C1', 'a', front=True)
+    s.resume()
+    assert done.wait(1)
+    assert [ items for _, items in writes ] == [['a'], ['b']]
+    s.stop()
+
+def test_stop_returns_unwritten():
+    s, writes, done = collect(1)
+    s.put('C1', 'a')
+    s.put('C2', 'b')
+    assert sorted(s.stop()) == ['a', 'b']
@@ -0,0 +1,46 @@
+import pytest
+
+from slacksocket.fakeslack import make_user
+from slacksocket.retry import RequestPolicy
+from slacksocket.webclient import WebClient
+
+def client(fake, path, role='writer'):
+    c = WebClient('xoxb-test', 0, api_url=fake.api_url, shared_path=path,
+                  shared_role=role, policy=RequestPolicy(rate_limit=False))
+    # check for changes by other clients on every read
+    c._users.check_interval = c._channels.check_interval = 0
+    return c
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join('directory.db'))
+
+def test_reader_sees_writer_refresh(fake, path):
+    writer = client(fake, path)
+    reader = client(fake, path, 'reader')
+    assert not reader.user('U00000001')
+
+    writer.preload()
+    assert reader.user('user1').id == 'U00000001'
+    assert reader.channel('channel1').id == 'C00000001'
+    assert len(reader._users) == 10
+    assert fake.calls['users.list'] == 1 # readers never refresh
+
+def test_reader_sees_writer_changes(fake, path):
+    writer = client(fake, path)
+    reader = client(fake, path, 'reader')
+    writer.preload()
+    assert reader.user('user1').name == 'user1' # cached
+
+    writer.apply_event({ 'type': 'user_change', 'user': dict(make_user(1), name='renamed') })
+    writer.apply_event({ 'type': 'channel_deleted', 'channel': 'C00000001' })
+    assert reader.user('U00000001').name == 'renamed'
+    assert not reader.channel('C00000001')
+
+def test_reader_ignores_changes(fake, path):
+    writer = client(fake, path)
+    reader = client(fake, path, 'reader')
+    writer.preload()
+
+    reader.apply_event({ 'type': 'channel_deleted', 'channel': 'C00000001' })
+    assert writer.channel('C00000001').name == 'channel1'
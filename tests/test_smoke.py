@@ -0,0 +1,54 @@
+import socket as sock
+import threading
+
+import pytest
+
+import slacksocket.errors as errors
+from slacksocket import SlackSocket
+from slacksocket.retry import RequestPolicy
+
+@pytest.fixture
+def socket(fake):
+    s = SlackSocket('xoxb-test', api_url=fake.api_url, handle_signals=False,
+                    policy=RequestPolicy(rate_limit=False))
+    yield s
+    s.close()
+
+def test_connect(fake, socket):
+    assert socket.wait_for_directory(timeout=5)
+    assert socket.lookup_user('user1').id == 'U00000001'
+    assert socket.lookup_channel('channel1').id == 'C00000001'
+
+def test_receive_event(fake, socket):
+    socket.wait_for_directory(timeout=5)
+    fake.wait_clients(timeout=5)
+    fake.send({ 'type': 'message', 'channel': 'C00000001',
+                'user': 'U00000001', 'text': 'hi' })
+
+    event = socket.get_event('message', timeout=5)
+    assert event['text'] == 'hi'
+    assert event.user.name == 'user1'
+    assert event.channel.name == 'channel1'
+
+def test_send_msg(fake, socket):
+    socket.wait_for_directory(timeout=5)
+    fake.wait_clients(timeout=5)
+
+    msg = socket.send_msg('hi', socket.lookup_channel('channel1'), timeout=5)
+    assert msg.sent
+
+def test_failed_login_leaves_no_threads(tmpdir):
+    # nothing listens on a just-closed port
+    closed = sock.socket()
+    closed.bind(('127.0.0.1', 0))
+    port = closed.getsockname()[1]
+    closed.close()
+
+    before = threading.active_count()
+    with pytest.raises(errors.TimeoutError):
+        SlackSocket('xoxb-test', api_url='http://127.0.0.1:%d/api/' % port,
+                    connect_timeout=.5, handle_signals=False, workers=4,
+                    coalesce={ 'user_typing': 1 }, record=str(tmpdir.join('rtm.rec')),
+                    policy=RequestPolicy(backoff=.1))
+    assert threading.active_count() == before
+    assert not tmpdir.join('rtm.rec').exists()
@@ -0,0 +1,63 @@
+import json
+import os
+
+from slacksocket.models import CompactUser
+from slacksocket.retry import RequestPolicy
+from slacksocket.webclient import WebClient
+
+def client(fake, tmpdir, **opts):
+    c = WebClient('xoxb-test', 0, api_url=fake.api_url, snapshot_dir=str(tmpdir),
+                  policy=RequestPolicy(rate_limit=False), **opts)
+    c.login()
+    return c
+
+def test_refresh_writes_snapshot(fake, tmpdir):
+    c = client(fake, tmpdir)
+    c.preload()
+    assert os.path.exists(c._snapshot_path())
+
+    c = client(fake, tmpdir)
+    assert c.load_snapshot()
+    assert c.user('user1').id == 'U00000001'
+    assert c.channel('channel1')['is_channel']
+    assert fake.calls['users.list'] == 1
+
+def test_compact_snapshot(fake, tmpdir):
+    client(fake, tmpdir, user_fields=['tz']).preload()
+    with open(os.path.join(str(tmpdir), 'slacksocket-T00000000.json')) as f:
+        snap = json.load(f)
+    assert snap['user_fields'] == ['tz']
+    assert snap['users'][1] == ['U00000001', 'user1', { 'tz': 'America/New_York' }]
+
+    c = client(fake, tmpdir, user_fields=['tz'])
+    assert c.load_snapshot()
+    user = c.user('user1')
+    assert isinstance(user, CompactUser)
+    assert user['tz'] == 'America/New_York'
+
+    # a snapshot saved with other fields is loaded as full rows, then compacted
+    c = client(fake, tmpdir, user_fields=['deleted'])
+    assert c.load_snapshot()
+    assert c.user('user1').keys() == ['id', 'name']
+
+def test_incompatible_snapshot_ignored(fake, tmpdir):
+    c = client(fake, tmpdir)
+    c.preload()
+    path = c._snapshot_path()
+    with open(path) as f:
+        snap = json.load(f)
+
+    snap['version'] = 1
+    with open(path, 'w') as f:
+        json.dump(snap, f)
+    assert not client(fake, tmpdir).load_snapshot()
+
+def test_expired_snapshot_ignored(fake, tmpdir):
+    client(fake, tmpdir).preload()
+    assert not client(fake, tmpdir, snapshot_max_age=-1).load_snapshot()
+
+def test_unreadable_snapshot_ignored(fake, tmpdir):
+    c = client(fake, tmpdir)
+    with open(os.path.join(str(tmpdir), 'slacksocket-T00000000.json'), 'w') as f:
+        f.write('{')
+    assert not c.load_snapshot()
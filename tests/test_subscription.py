@@ -0,0 +1,102 @@
+import time
+import threading
+
+import pytest
+
+import slacksocket.errors as errors
+from slacksocket.models import SlackEvent
+from slacksocket.subscription import Subscription
+
+def event(etype, user=None, **fields):
+    data = dict(fields, type=etype)
+    if user:
+        data['user'] = user
+    return SlackEvent(data)
+
+def drain(sub):
+    return [ (e.type, e.get('user'), e.get('presence')) for e in sub.get_events(100, timeout=0) ]
+
+def test_drop_oldest():
+    sub = Subscription(max_queue=2)
+    for n in range(3):
+        sub.put(event('message', n=n))
+    assert [ e['n'] for e in sub.get_events(10, timeout=0) ] == [1, 2]
+    assert sub.dropped == { 'overflow': 1 }
+
+def test_block():
+    sub = Subscription(max_queue=1, overflow='block')
+    sub.put(event('message', n=0))
+
+    t = threading.Thread(target=sub.put, args=(event('message', n=1),))
+    t.start()
+    t.join(.1)
+    assert t.is_alive() # waiting for room
+
+    assert sub.get_event()['n'] == 0
+    t.join(1)
+    assert sub.get_event()['n'] == 1
+    assert sub.dropped == {}
+
+def test_priority_sheds_lowest_first():
+    sub = Subscription(max_queue=3, overflow='priority')
+    sub.put(event('presence_change', 'U1'))
+    sub.put(event('user_typing', 'U1'))
+    sub.put(event('message', 'U1'))
+
+    sub.put(event('message', 'U2')) # sheds user_typing
+    sub.put(event('message', 'U3')) # sheds presence_change
+    sub.put(event('user_typing', 'U4')) # lower than any queued, so shed itself
+
+    assert drain(sub) == [ ('message', 'U1', None),
+                           ('message', 'U2', None),
+                           ('message', 'U3', None) ]
+    assert sub.dropped == { 'shed': 3 }
+
+def test_priority_keeps_order_across_levels():
+    sub = Subscription(max_queue=10, overflow='priority')
+    types = [ 'message', 'user_typing', 'presence_change', 'message', 'user_typing' ]
+    for etype in types:
+        sub.put(event(etype))
+    assert [ e.type for e in sub.get_events(10, timeout=0) ] == types
+
+def test_priority_errors_not_shed():
+    sub = Subscription(max_queue=1, overflow='priority')
+    sub.put(event('message'))
+    sub.put(errors.ExitError('stopped'))
+    assert sub.get_event().type == 'message'
+    with pytest.raises(errors.ExitError):
+        sub.get_event()
+
+def test_coalesce_replaces_presence():
+    sub = Subscription(max_queue=2, overflow='coalesce')
+    sub.put(event('presence_change', 'U1', presence='away'))
+    sub.put(event('presence_change', 'U2', presence='away'))
+    sub.put(event('presence_change', 'U1', presence='active'))
+
+    assert drain(sub) == [ ('presence_change', 'U1', 'active'),
+                           ('presence_change', 'U2', 'away') ]
+    assert sub.dropped == { 'coalesced': 1 }
+
+def test_coalesce_forgets_consumed_presence():
+    sub = Subscription(max_queue=1, overflow='coalesce')
+    sub.put(event('presence_change', 'U1', presence='away'))
+    assert sub.get_event()['presence'] == 'away'
+
+    sub.put(event('message', 'U2'))
+    sub.put(event('presence_change', 'U1', presence='active')) # drops the message
+    assert drain(sub) == [ ('presence_change', 'U1', 'active') ]
+    assert sub.dropped == { 'overflow': 1 }
+
+@pytest.mark.parametrize('overflow', ['drop_oldest', 'priority', 'coalesce'])
+def test_overflow_constant_time(overflow):
+    # each overflowing event costs the same, however large the queue
+    def cost(max_queue, n=2000):
+        sub = Subscription(max_queue=max_queue, overflow=overflow)
+        for i in range(max_queue):
+            sub.put(event('message', 'U%d' % i))
+        start = time.perf_counter()
+        for i in range(n):
+            sub.put(event('presence_change', 'U%d' % (i % 50)))
+        return time.perf_counter() - start
+
+    assert cost(20000) < cost(100) * 10